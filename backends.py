@@ -0,0 +1,277 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+
+class Backend:
+    """One model server with its own concurrency cap and latency statistics."""
+
+    def __init__(self, url, max_concurrency=4, health_url=None):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.health_url = health_url or url
+        self.outstanding = 0
+        self.ewma_latency = None
+        self.healthy = True
+        self.failures = 0
+        self.unhealthy_since = None
+
+    def has_capacity(self):
+        """Check if the backend can take another request."""
+        return self.healthy and self.outstanding < self.max_concurrency
+
+    def __repr__(self):
+        return f"Backend({self.url!r}, outstanding={self.outstanding}, ewma={self.ewma_latency}, healthy={self.healthy})"
+
+
+class NoHealthyBackendError(Exception):
+    """Raised when no backend in the pool is healthy."""
+
+
+def is_throttled(error):
+    """
+    Check if an exception is an HTTP 429: requests.HTTPError (status on .response),
+    ollama.ResponseError (.status_code) or aiohttp.ClientResponseError (.status).
+    """
+    response = getattr(error, "response", None)
+    status = (
+        getattr(error, "status_code", None)
+        or getattr(response, "status_code", None)
+        or getattr(error, "status", None)
+    )
+    return status == 429
+
+
+class BackendPool:
+    """
+    Dispatch requests across several model servers.
+    Strategies: "least_outstanding" picks the backend with the fewest in-flight
+    requests, "ewma" picks the one with the lowest smoothed latency.
+    A backend marked unhealthy is tried again after retry_after seconds even without
+    the health check thread; one more failure marks it unhealthy again.
+    """
+
+    STRATEGIES = ("least_outstanding", "ewma")
+
+    def __init__(self, backends, strategy="least_outstanding", alpha=0.3, max_failures=3, retry_after=30.0):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy!r}, expected one of {self.STRATEGIES}")
+        if not backends:
+            raise ValueError("BackendPool needs at least one backend.")
+        self.backends = list(backends)
+        self.strategy = strategy
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_urls(cls, urls, max_concurrency=4, **kwargs):
+        """Build a pool from a list of endpoint URLs sharing the same concurrency cap."""
+        return cls([Backend(url, max_concurrency=max_concurrency) for url in urls], **kwargs)
+
+    def _score(self, backend):
+        if self.strategy == "ewma":
+            # Untried backends score 0 so every server gets sampled at least once.
+            latency = backend.ewma_latency or 0.0
+            return latency * (backend.outstanding + 1)
+        return backend.outstanding
+
+    def _mark_unhealthy(self, backend):
+        backend.healthy = False
+        backend.unhealthy_since = time.monotonic()
+
+    def _revive_due(self):
+        """Give backends that have been unhealthy for retry_after seconds another try."""
+        now = time.monotonic()
+        for backend in self.backends:
+            if not backend.healthy and now - backend.unhealthy_since >= self.retry_after:
+                print(f"Retrying backend {backend.url} after {self.retry_after}s cooldown.")
+                backend.healthy = True
+                backend.failures = self.max_failures - 1
+
+    def _pick(self):
+        candidates = [b for b in self.backends if b.has_capacity()]
+        if not candidates:
+            return None
+        return min(candidates, key=self._score)
+
+    def try_acquire(self):
+        """Reserve a slot on the best available backend without waiting, or return None."""
+        with self._cond:
+            self._revive_due()
+            if not any(b.healthy for b in self.backends):
+                raise NoHealthyBackendError("No healthy backend available.")
+            backend = self._pick()
+            if backend is not None:
+                backend.outstanding += 1
+            return backend
+
+    def acquire(self, timeout=None):
+        """Reserve a slot on the best available backend, waiting while all are busy."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._revive_due()
+                if not any(b.healthy for b in self.backends):
+                    raise NoHealthyBackendError("No healthy backend available.")
+                backend = self._pick()
+                if backend is not None:
+                    backend.outstanding += 1
+                    return backend
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    raise TimeoutError("Timed out waiting for a free backend.")
+                self._cond.wait(left)
+
+    def release(self, backend, latency=None, ok=True, throttled=False):
+        """
+        Return a slot and record the outcome of the request. A throttled request (429)
+        says the server is busy, not broken, so it counts as neither success nor failure.
+        """
+        with self._cond:
+            backend.outstanding -= 1
+            if throttled:
+                pass
+            elif ok:
+                backend.failures = 0
+                if latency is not None:
+                    if backend.ewma_latency is None:
+                        backend.ewma_latency = latency
+                    else:
+                        backend.ewma_latency = self.alpha * latency + (1 - self.alpha) * backend.ewma_latency
+            else:
+                backend.failures += 1
+                if backend.failures >= self.max_failures:
+                    print(f"Marking backend {backend.url} unhealthy after {backend.failures} failures.")
+                    self._mark_unhealthy(backend)
+            self._cond.notify_all()
+
+    @contextmanager
+    def session(self, timeout=None):
+        """Context manager around acquire/release that times the request."""
+        backend = self.acquire(timeout)
+        start = time.monotonic()
+        ok = False
+        throttled = False
+        try:
+            yield backend
+            ok = True
+        except GeneratorExit:
+            # A stream read inside the session was closed early; not a backend failure
+            ok = True
+            raise
+        except Exception as e:
+            throttled = is_throttled(e)
+            raise
+        finally:
+            self.release(backend, time.monotonic() - start, ok, throttled)
+
+    @asynccontextmanager
+    async def session_async(self, poll_interval=0.005):
+        """Async version of session that yields to the event loop while all backends are busy."""
+        backend = self.try_acquire()
+        while backend is None:
+            await asyncio.sleep(poll_interval)
+            backend = self.try_acquire()
+        start = time.monotonic()
+        ok = False
+        throttled = False
+        try:
+            yield backend
+            ok = True
+        except Exception as e:
+            throttled = is_throttled(e)
+            raise
+        finally:
+            self.release(backend, time.monotonic() - start, ok, throttled)
+
+    def check_health(self, timeout=2.0):
+        """Probe every backend once and update its health flag."""
+        for backend in self.backends:
+            try:
+                with urlopen(backend.health_url, timeout=timeout) as response:
+                    healthy = response.status < 500
+            except HTTPError as e:
+                # 4xx still means the server is up (e.g. GET on a POST-only endpoint).
+                healthy = e.code < 500
+            except Exception:
+                healthy = False
+            with self._cond:
+                if healthy and not backend.healthy:
+                    print(f"Backend {backend.url} is healthy again.")
+                    backend.failures = 0
+                    backend.healthy = True
+                elif not healthy and backend.healthy:
+                    self._mark_unhealthy(backend)
+                self._cond.notify_all()
+
+    def start_health_checks(self, interval=10.0, timeout=2.0):
+        """Run check_health periodically in a daemon thread."""
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.check_health(timeout)
+
+        self._stop.clear()
+        self._health_thread = threading.Thread(target=loop, daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        """Stop the background health check thread."""
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+
+if __name__ == "__main__":
+    # Dispatch against local fake servers with different latencies.
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.request import Request
+
+    def fake_server(delay):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.end_headers()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(delay)
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b'{"response": "ok"}')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+    servers = [fake_server(delay) for delay in (0.01, 0.05, 0.2)]
+    pool = BackendPool.from_urls([url for _, url in servers], max_concurrency=4, strategy="ewma")
+    pool.check_health()
+
+    def call(_):
+        with pool.session() as backend:
+            with urlopen(Request(backend.url, data=b"{}", method="POST"), timeout=5) as response:
+                response.read()
+            return backend.url
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        used = list(executor.map(call, range(60)))
+
+    for backend in pool.backends:
+        print(f"{backend.url}: {used.count(backend.url)} requests, ewma={backend.ewma_latency:.3f}s")
+    for server, _ in servers:
+        server.shutdown()
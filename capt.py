@@ -1,28 +1,76 @@
 import os
 import warnings
 import requests
-import base64
-import io
-import json
 from bs4 import BeautifulSoup
-from PIL import Image
-from io import BytesIO
+from PIL import Image, ImageFile
 import time
+import argparse
+from contextlib import closing
 
 warnings.filterwarnings("ignore")
 
 import asyncio
 import os
 import shutil
+import tempfile
 import warnings
 
 import aiohttp
+import httpx
 import requests
 from bs4 import BeautifulSoup
 import ollama
 
+from backends import BackendPool
+from complexity_classifier import COMPLEX_KEYWORDS
+from image_features import image_content_score
+from profiling import add_profile_arguments, profiler_from_args, start_profile
+from prompts import CAPTION_SYSTEM_PROMPT, LLAVA_PROMPT, get_template, llava_payload, ollama_request
+from resilience import (
+    AbortableSession,
+    CircuitBreaker,
+    async_hedged_call,
+    async_retry_call,
+    hedged_call,
+    retry_call,
+)
+from sinks import make_record
+from streaming import (
+    CHUNK_SIZE,
+    FilePayload,
+    MemoryBudget,
+    stream_aiohttp_response_to_file,
+    stream_response_to_file,
+)
+
 warnings.filterwarnings("ignore")
 
+# File description pages tried, in order, when gathering image metadata.
+FILE_PAGE_URLS = ["https://commons.wikimedia.org/wiki/File:", "https://en.wikipedia.org/wiki/File:"]
+
+# (connect, read) timeouts in seconds for each pipeline stage.
+STAGE_TIMEOUTS = {
+    "metadata": (3.05, 15),
+    "image": (3.05, 30),
+    "model": (3.05, 120),
+}
+
+# How long Ollama keeps the model loaded after the last request.
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Same stage timeouts expressed for aiohttp.
+ASYNC_STAGE_TIMEOUTS = {
+    stage: aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+    for stage, (connect, read) in STAGE_TIMEOUTS.items()
+}
+
+# Upper bound on image bytes held in memory across all in-flight downloads and decodes.
+IMAGE_MEMORY_BUDGET = 256 * 1024 * 1024
+image_budget = MemoryBudget(IMAGE_MEMORY_BUDGET)
+
+# Shared breaker for the LLaVA endpoint; when open, captions fall back to MetadataImageCaptioner.
+llava_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+
 
 class WikipediaImageScrapper:
     """Simple scrapper for fetching image data from Wikipedia pages."""
@@ -60,8 +108,8 @@ class WikipediaImageScrapper:
                 if response.status == 200:
                     filename = os.path.basename(url)
                     file_path = os.path.join("images_wiki", filename)
-                    with open(file_path, "wb") as f:
-                        f.write(await response.read())
+                    async with image_budget.reserve_async(CHUNK_SIZE):
+                        await stream_aiohttp_response_to_file(response, file_path)
                     return file_path, url
         except Exception as e:
             print(f"Error downloading image from {url}: {e}")
@@ -76,21 +124,100 @@ class WikipediaImageScrapper:
 class MetadataImageCaptioner:
     """Generate captions for images using title and metadata."""
 
-    def __init__(self, url):
+    def __init__(self, url, backend_pool=None, model="wizardlm2", keep_alive=OLLAMA_KEEP_ALIVE,
+                 system_prompt=CAPTION_SYSTEM_PROMPT, template="caption"):
         self.url = url
         self.image_folder = "images_wiki"
         self.captions = {}
+        self.backend_pool = backend_pool
+        self.model = model
+        self.keep_alive = keep_alive
+        self.system_prompt = system_prompt
+        self.template = get_template(template)
+        self._clients = {}
+
+    def _client(self, host):
+        """Return the ollama client for a host (None means the default host), with the model stage timeouts."""
+        if host not in self._clients:
+            connect, read = STAGE_TIMEOUTS["model"]
+            self._clients[host] = ollama.Client(host=host, timeout=httpx.Timeout(read, connect=connect))
+        return self._clients[host]
+
+    def _generate(self, prompt, **kwargs):
+        """Run a non-streaming ollama.generate on the default host, or on a backend picked from the pool."""
+        request = ollama_request(self.model, prompt, system=self.system_prompt, keep_alive=self.keep_alive, **kwargs)
+        if self.backend_pool is None:
+            return self._client(None).generate(**request)
+        with self.backend_pool.session() as backend:
+            return self._client(backend.url).generate(**request)
+
+    def _generate_stream(self, prompt, **kwargs):
+        """
+        Streaming version of _generate. ollama only sends the request once its stream is
+        iterated, so the pool slot is held until the stream is exhausted or closed.
+        """
+        request = ollama_request(self.model, prompt, system=self.system_prompt, keep_alive=self.keep_alive,
+                                 stream=True, **kwargs)
+        if self.backend_pool is None:
+            yield from self._client(None).generate(**request)
+            return
+        with self.backend_pool.session() as backend:
+            yield from self._client(backend.url).generate(**request)
+
+    def _prompt(self, context, full_description):
+        """Render the shared caption template, truncating the metadata to the token budget."""
+        return self.template.render({"title": context, "description": full_description})
+
+    def warm_up(self):
+        """
+        Load the model on every host and evaluate the shared system prompt once,
+        so the first real caption does not pay for the model load.
+        :return: Dictionary mapping each host to its warm-up time in seconds.
+        """
+        hosts = [None] if self.backend_pool is None else [b.url for b in self.backend_pool.backends]
+        timings = {}
+        for host in hosts:
+            start = time.perf_counter()
+            try:
+                self._client(host).generate(**ollama_request(
+                    self.model, self._prompt("", ""), system=self.system_prompt,
+                    keep_alive=self.keep_alive, options={"num_predict": 1},
+                ))
+                timings[host or "default"] = time.perf_counter() - start
+            except Exception as e:
+                print(f"Error warming up {self.model} on {host or 'default host'}: {e}")
+        return timings
+
+    def measure_ttft(self, context="", full_description=""):
+        """Return the time in seconds until the first streamed token of a caption arrives."""
+        prompt = self._prompt(context, full_description)
+        start = time.perf_counter()
+        try:
+            with closing(self._generate_stream(prompt, options={"num_predict": 1})) as stream:
+                for _ in stream:
+                    return time.perf_counter() - start
+        except Exception as e:
+            print(f"Error measuring time to first token: {e}")
+        return None
+
+    def stream_caption(self, context, full_description):
+        """Generate a caption like generate_caption, yielding text fragments as the model produces them."""
+        prompt = self._prompt(context, full_description)
+        try:
+            # Closing the stream when the consumer stops early frees the backend slot right away
+            with closing(self._generate_stream(prompt)) as stream:
+                for chunk in stream:
+                    yield chunk.get("response", "")
+        except Exception as e:
+            print(f"Error generating caption: {e}")
 
     def generate_caption(self, context, full_description):
         """Generate a caption for an image using the LLM model."""
-        prompt = (
-            "You are an intelligent assistant. Based on the given title and metadata, "
-            "generate a descriptive caption for the image. Title: {context}. Metadata: {full_description}."
-        ).format(context=context, full_description=full_description)
+        prompt = self._prompt(context, full_description)
 
         try:
             print("Generated prompt:", prompt)  # Debugging
-            response = ollama.generate(model="wizardlm2", prompt=prompt)
+            response = self._generate(prompt)
             return response.get("response", "No response generated.")
         except Exception as e:
             print(f"Error generating caption: {e}")
@@ -98,9 +225,9 @@ class MetadataImageCaptioner:
 
     def gather_image_metadata(self, filename):
         """Gather metadata about an image from Wikimedia or Wikipedia."""
-        for base_url in ["https://commons.wikimedia.org/wiki/File:", "https://en.wikipedia.org/wiki/File:"]:
+        for base_url in FILE_PAGE_URLS:
             try:
-                response = requests.get(base_url + filename)
+                response = requests.get(base_url + filename, timeout=STAGE_TIMEOUTS["metadata"])
                 if response.status_code == 200:
                     soup = BeautifulSoup(response.content, "html.parser")
                     title = soup.find("h1", {"id": "firstHeading"}).get_text(strip=True) if soup.find("h1", {"id": "firstHeading"}) else "Unknown Title"
@@ -111,19 +238,48 @@ class MetadataImageCaptioner:
         return {"title": "Unknown Title", "description": "No metadata found."}
 
 
-    async def process_single_image(self, image_url):
-        """Process a single image URL asynchronously and return a dictionary with the image URL as the key and the generated caption as the value."""
+    async def process_single_image(self, image_url, sink=None, profile=None):
+        """
+        Process a single image URL asynchronously and return a dictionary with the image URL as the key and the generated caption as the value.
+        If a sink is given, the caption record is streamed to it instead of being kept in memory.
+        profile is None, True or a profiling.Profiler; see profiling.start_profile.
+        """
+        run = start_profile(profile, "process_single_image")
+        run.watch_event_loop()
+        try:
+            return await self._process_single_image(image_url, sink, run)
+        finally:
+            run.finish()
+
+    async def _process_single_image(self, image_url, sink, run):
         async with aiohttp.ClientSession() as session:
             os.makedirs(self.image_folder, exist_ok=True)
             scrapper = WikipediaImageScrapper(self.url)
-            file_path, url = await scrapper.download_image(session, image_url)
+            start = time.perf_counter()
+            with run.stage("download"):
+                file_path, url = await scrapper.download_image(session, image_url)
             if not file_path:
                 return {}
+            download_time = time.perf_counter() - start
 
             filename = os.path.basename(file_path)
-            title, metadata = self.gather_image_metadata(filename)
-            caption = self.generate_caption(title, full_description=metadata)
-            self.captions[url] = caption
+            start = time.perf_counter()
+            with run.stage("metadata"):
+                metadata = self.gather_image_metadata(filename)
+            metadata_time = time.perf_counter() - start
+            start = time.perf_counter()
+            with run.stage("caption"):
+                caption = self.generate_caption(metadata["title"], full_description=metadata["description"])
+            caption_time = time.perf_counter() - start
+
+            if sink is None:
+                self.captions[url] = caption
+            else:
+                sink.write(make_record(
+                    url, caption, "MetadataImageCaptioner", routing_reason="direct",
+                    latencies={"download": download_time, "metadata": metadata_time, "caption": caption_time},
+                    model=self.model, prompt=self.template.full_text(self.system_prompt),
+                ))
 
             shutil.rmtree(self.image_folder, ignore_errors=True)
             return self.captions
@@ -139,15 +295,25 @@ class MetadataImageCaptioner:
 
 
 
-def select_captioner(metadata, image_url, threshold_length=20):
-    start_time = time.time() 
+def select_captioner(metadata, image_url, threshold_length=20, return_reason=False, content_threshold=0.5,
+                     classifier=None):
     """
     Selects a captioner based on metadata, image quality, and other factors.
     :param metadata: Dictionary containing image metadata.
     :param image_url: URL of the image for quality checks.
     :param threshold_length: Minimum length of metadata description for using simpler captioners.
+    :param content_threshold: Minimum thumbnail complexity score for using LlavaImageCaptioner, or None to skip the check.
+    :param classifier: Optional ComplexityClassifier used instead of the keyword list for the context check.
+    :param return_reason: If True, return a (captioner, reason) tuple instead of just the class.
     :return: Selected captioner class.
     """
+    start_time = time.time()
+
+    def chosen(captioner, reason):
+        elapsed_time = time.time() - start_time
+        print(f"Execution time: {elapsed_time:.6f} seconds")
+        return (captioner, reason) if return_reason else captioner
+
     description = metadata.get("description", "").strip()
     title = metadata.get("title", "").strip()
 
@@ -157,105 +323,117 @@ def select_captioner(metadata, image_url, threshold_length=20):
     # Step 1: If either title or description is missing, use LlavaImageCaptioner
     if not description or not title:
         print("Either description or title is missing, using LlavaImageCaptioner for rich caption generation.")
-        elapsed_time = time.time() - start_time
-        print(f"Execution time: {elapsed_time:.6f} seconds")
-
-        return LlavaImageCaptioner
+        return chosen(LlavaImageCaptioner, "missing_metadata")
 
     # Step 2: Proceed to other factors if both title and description are available
     # Factor 1: If the description is short (based on threshold length), use LlavaImageCaptioner
     if len(description) < threshold_length:
         print(" using LlavaImageCaptioner for rich caption generation.")
-        elapsed_time = time.time() - start_time
-        print(f"Execution time: {elapsed_time:.6f} seconds")
-        return LlavaImageCaptioner
+        return chosen(LlavaImageCaptioner, "short_description")
 
     # Factor 2: Check if image resolution is high, use LlavaImageCaptioner for high-res images
     if is_high_resolution(image_url):
         print("Using LlavaImageCaptioner for high-resolution image.")
-        elapsed_time = time.time() - start_time
-        print(f"Execution time: {elapsed_time:.6f} seconds")
-        return LlavaImageCaptioner
+        return chosen(LlavaImageCaptioner, "high_resolution")
 
     # Factor 3: If metadata indicates a complex context, use LlavaImageCaptioner
-    if is_complex_context(metadata):
+    if is_complex_context(metadata, classifier=classifier):
         print("Using LlavaImageCaptioner for complex image context.")
-        elapsed_time = time.time() - start_time
-        print(f"Execution time: {elapsed_time:.6f} seconds")
-        return LlavaImageCaptioner
+        return chosen(LlavaImageCaptioner, "complex_context")
+
+    # Factor 4: If a thumbnail of the image looks like a diagram, chart or scan, use LlavaImageCaptioner
+    if content_threshold is not None:
+        score = image_content_score(image_url)
+        if score is not None and score >= content_threshold:
+            print(f"Using LlavaImageCaptioner for complex image content (score {score:.2f}).")
+            return chosen(LlavaImageCaptioner, "complex_content")
 
     # Final fallback: Use MetadataImageCaptioner
     print("Using MetadataImageCaptioner for general images.")
-    elapsed_time = time.time() - start_time
-    print(f"Execution time: {elapsed_time:.6f} seconds")
-    return MetadataImageCaptioner
+    return chosen(MetadataImageCaptioner, "general")
 
 
 def is_high_resolution(image_url, min_width=1600, min_height=1600):
     """Check if an image is high resolution based on URL."""
     try:
-        # Download the image
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            # Open image with PIL
-            img = Image.open(BytesIO(response.content))
-            width, height = img.size  # Get image dimensions
+        # Stream the image and stop as soon as PIL has parsed the header
+        with requests.get(image_url, stream=True, timeout=STAGE_TIMEOUTS["image"]) as response:
+            if response.status_code == 200:
+                parser = ImageFile.Parser()
+                for chunk in response.iter_content(chunk_size=4096):
+                    parser.feed(chunk)
+                    if parser.image:
+                        break
+                if not parser.image:
+                    raise Exception("Could not read image header")
+                width, height = parser.image.size  # Get image dimensions
             
-            # Check if the resolution meets the threshold
-            if width >= min_width and height >= min_height:
-                print(f"Image is high resolution: {width}x{height}")
-                return True
+                # Check if the resolution meets the threshold
+                if width >= min_width and height >= min_height:
+                    print(f"Image is high resolution: {width}x{height}")
+                    return True
+                else:
+                    print(f"Image is low resolution: {width}x{height}")
+                    return False
             else:
-                print(f"Image is low resolution: {width}x{height}")
+                print(f"Failed to download image from {image_url}")
                 return False
-        else:
-            print(f"Failed to download image from {image_url}")
-            return False
     except Exception as e:
         print(f"Error checking resolution for {image_url}: {e}")
         return False
 
 class LlavaImageCaptioner:
     @staticmethod
-    def download_image(url):
-        """Downloads an image from a URL and returns a PIL Image object."""
-        response = requests.get(url)
-        if response.status_code == 200:
-            return Image.open(io.BytesIO(response.content))
-        else:
-            msg = f"Failed to download image. Status code: {response.status_code}"
-            raise Exception(msg)
+    def download_image_to_file(url, path):
+        """Streams an image from a URL to disk and returns its size in bytes."""
+        response = retry_call(requests.get, url, stream=True, timeout=STAGE_TIMEOUTS["image"],
+                              retries=2, retry_on=(requests.RequestException,))
+        with response:
+            if response.status_code != 200:
+                msg = f"Failed to download image. Status code: {response.status_code}"
+                raise Exception(msg)
+            return stream_response_to_file(response, path)
 
     @staticmethod
-    def encode_image(image):
-        """Encodes a PIL Image object to base64."""
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    def prepare_jpeg(path, jpeg_path):
+        """Returns the path of a JPEG version of the image, re-encoding only if it is not a JPEG already."""
+        with Image.open(path) as image:
+            if image.format == "JPEG":
+                return path
+            # Decoding holds the full bitmap in memory, so reserve it from the budget first.
+            with image_budget.reserve(image.width * image.height * 4):
+                image.convert("RGB").save(jpeg_path, format="JPEG")
+        return jpeg_path
 
     @staticmethod
-    def gather_image_metadata(image_url):
+    def parse_image_metadata(html_content):
+        """Extracts title and description from the HTML of a Wikipedia/Wikimedia file page."""
+        soup = BeautifulSoup(html_content, "html.parser")
+        metadata = {}
+
+        # Extract title
+        title_tag = soup.find("h1", {"id": "firstHeading"})
+        metadata["title"] = title_tag.text if title_tag else "No title"
+
+        # Extract description (first paragraph)
+        description_tag = soup.find("div", {"class": "description"})
+        if description_tag:
+            paragraph = description_tag.find("p")
+            metadata["description"] = paragraph.text if paragraph else "No description"
+        else:
+            metadata["description"] = "No description"
+
+        print(f"Title: {metadata['title']}")
+        print(f"Description: {metadata['description']}")
+        return metadata
+
+    @classmethod
+    def gather_image_metadata(cls, image_url):
         """Fetches and returns metadata for an image from a Wikipedia/Wikimedia URL."""
         try:
-            response = requests.get(image_url)
+            response = requests.get(image_url, timeout=STAGE_TIMEOUTS["metadata"])
             if response.status_code == 200:
-                soup = BeautifulSoup(response.content, "html.parser")
-                metadata = {}
-
-                # Extract title
-                title_tag = soup.find("h1", {"id": "firstHeading"})
-                metadata["title"] = title_tag.text if title_tag else "No title"
-
-                # Extract description (first paragraph)
-                description_tag = soup.find("div", {"class": "description"})
-                if description_tag:
-                    paragraph = description_tag.find("p")
-                    metadata["description"] = paragraph.text if paragraph else "No description"
-                else:
-                    metadata["description"] = "No description"
-
-                print(f"Title: {metadata['title']}")
-                print(f"Description: {metadata['description']}")
+                metadata = cls.parse_image_metadata(response.content)
             else:
                 print(f"Failed to fetch metadata, status code: {response.status_code}")
                 metadata = {"title": "No title", "description": "No description"}
@@ -268,69 +446,237 @@ class LlavaImageCaptioner:
 
     @staticmethod
     def create_prompt(metadata, prompt_template):
-        """Dynamically inserts metadata into the provided prompt template."""
+        """
+        Inserts metadata into a prompt template: a registered template name from prompts.py,
+        or a template string using {Title}/{Description} (or {context}/{full_description}).
+        """
         title = metadata.get("title", "No title")
         description = metadata.get("description", "No description")
-        return prompt_template.format(Title=title, Description=description)
+        return get_template(prompt_template).render({"title": title, "description": description})
+
+    @staticmethod
+    def post_to_model(model_url, payload, session=requests):
+        """Sends the payload to one model endpoint, raising on errors worth retrying."""
+        headers = {"Content-Type": "application/json"}
+        if isinstance(payload, FilePayload):
+            # Stream the body from disk rather than loading it into memory
+            with payload.open() as body:
+                response = session.post(model_url, data=body, headers=headers, timeout=STAGE_TIMEOUTS["model"])
+        else:
+            response = session.post(model_url, data=payload, headers=headers, timeout=STAGE_TIMEOUTS["model"])
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    @classmethod
+    def send_to_model(cls, model_url, payload, retries=2, hedge_delay=2.0):
+        """
+        Sends the payload with jittered retries. If model_url is a list of endpoints,
+        the request is hedged across them and the first response wins; the losing
+        requests are aborted. If it is a BackendPool, every attempt is dispatched to
+        the pool's best backend.
+        """
+        def attempt(url, session=requests):
+            return retry_call(cls.post_to_model, url, payload, session, retries=retries,
+                              retry_on=(requests.RequestException,))
+
+        if isinstance(model_url, BackendPool):
+            def pooled_attempt():
+                with model_url.session() as backend:
+                    return cls.post_to_model(backend.url, payload)
+
+            return retry_call(pooled_attempt, retries=retries, retry_on=(requests.RequestException,))
+        if isinstance(model_url, (list, tuple)):
+            sessions = []
+
+            def hedged_attempt(url):
+                session = AbortableSession()
+                sessions.append(session)
+                return attempt(url, session)
+
+            try:
+                return hedged_call(hedged_attempt, list(model_url), hedge_delay=hedge_delay)
+            finally:
+                # Responses are read in full, so this only cuts off the requests still running
+                for session in sessions:
+                    session.close()
+        return attempt(model_url)
 
     @classmethod
     def test_model_with_image_url_and_text(cls, image_url, prompt_template, page_url, model_name, model_url):
-        """Tests the model by sending an image and prompt to the API."""
+        """
+        Tests the model by sending an image and prompt to the API.
+        :return: The generated caption, or None if the model could not be reached.
+        """
+        # Cheap check that does not claim the half-open probe; that happens right before the model call
+        if llava_breaker.state == CircuitBreaker.OPEN:
+            print("LLaVA circuit breaker is open, skipping model call.")
+            return None
+
+        work_dir = tempfile.mkdtemp(prefix="llava_")
         try:
-            # Download the image
-            image = cls.download_image(image_url)
+            # Download the image to disk
+            image_path = os.path.join(work_dir, "image")
+            cls.download_image_to_file(image_url, image_path)
 
             # Get metadata
             metadata = cls.gather_image_metadata(page_url)
 
-            # Encode the image to base64
-            encoded_image = cls.encode_image(image)
+            # Make sure the image is a JPEG
+            jpeg_path = cls.prepare_jpeg(image_path, os.path.join(work_dir, "image.jpg"))
 
             # Create the final prompt
             full_prompt = cls.create_prompt(metadata, prompt_template)
             print("Full prompt being sent to the model:")
             print(full_prompt)
 
-            # Define the payload
-            payload = json.dumps(
-                {
-                    "model": model_name,
-                    "prompt": full_prompt,
-                    "images": [encoded_image],
-                    "stream": False,
-                }
-            )
+            # Write the payload to disk, base64-encoding the image in chunks
+            payload = llava_payload(os.path.join(work_dir, "payload.json"), model_name, full_prompt, [jpeg_path])
 
             # Send the request to the model API
-            response = requests.post(model_url, data=payload, headers={"Content-Type": "application/json"})
+            if not llava_breaker.allow_request():
+                print("LLaVA circuit breaker is open, skipping model call.")
+                return None
+            try:
+                response = cls.send_to_model(model_url, payload)
+            except Exception:
+                llava_breaker.record_failure()
+                raise
 
             # Check if the request was successful
             if response.status_code == 200:
                 result = response.json()
+                llava_breaker.record_success()
                 print("Response from model:")
                 print(result["response"])
+                return result["response"]
             else:
+                llava_breaker.record_failure()
                 print(f"Error: Received status code {response.status_code}")
                 print(response.text)
 
         except Exception as e:
             print(f"An error occurred: {e}")
-def is_complex_context(metadata):
-    """Check if the metadata implies a complex image (like a diagram or scientific image)."""
-    # Keywords related to complex or technical content
-    complex_keywords = ["data visualization","visualizations","data-driven images","plots","diagram", "chart", "scientific", "technical", "graph", "medical", "research", 
-        "algorithm", "experiment", "data", "simulation", "genetics", "chemistry", "physics", 
-        "map", "model", "equation", "code snippet", "infographic", "flowchart", 
-        "study", "theory", "hypothesis", "analysis", "vector", "SVG", "historical", 
-        "geography", "archaeological", "expedition", "journal", "conference", "paper", "patent", 
-        "published", "resolution"]
-    
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return None
+
+    @staticmethod
+    async def download_image_to_file_async(session, url, path):
+        """Async version of download_image_to_file using an aiohttp session."""
+        async with session.get(url, timeout=ASYNC_STAGE_TIMEOUTS["image"]) as response:
+            if response.status != 200:
+                msg = f"Failed to download image. Status code: {response.status}"
+                raise Exception(msg)
+            async with image_budget.reserve_async(CHUNK_SIZE):
+                return await stream_aiohttp_response_to_file(response, path)
+
+    @classmethod
+    async def gather_image_metadata_async(cls, session, page_url):
+        """Async version of gather_image_metadata using an aiohttp session."""
+        try:
+            async with session.get(page_url, timeout=ASYNC_STAGE_TIMEOUTS["metadata"]) as response:
+                if response.status == 200:
+                    return cls.parse_image_metadata(await response.text())
+                print(f"Failed to fetch metadata, status code: {response.status}")
+        except Exception as e:
+            print(f"Error fetching metadata: {str(e)}")
+        return {"title": "No title", "description": "No description"}
+
+    @staticmethod
+    async def post_to_model_async(session, model_url, payload):
+        """Async version of post_to_model; returns the parsed JSON response."""
+        with payload.open() as body:
+            async with session.post(
+                model_url, data=body, headers={"Content-Type": "application/json"},
+                timeout=ASYNC_STAGE_TIMEOUTS["model"],
+            ) as response:
+                if response.status == 429 or response.status >= 500:
+                    response.raise_for_status()
+                if response.status != 200:
+                    raise Exception(f"Received status code {response.status}: {await response.text()}")
+                return await response.json(content_type=None)
+
+    @classmethod
+    async def send_to_model_async(cls, session, model_url, payload, retries=2, hedge_delay=2.0):
+        """Async version of send_to_model; accepts a URL, a list of URLs to hedge across, or a BackendPool."""
+        retry_on = (aiohttp.ClientError, asyncio.TimeoutError)
+
+        async def attempt(url):
+            return await async_retry_call(cls.post_to_model_async, session, url, payload,
+                                          retries=retries, retry_on=retry_on)
+
+        if isinstance(model_url, BackendPool):
+            async def pooled_attempt():
+                async with model_url.session_async() as backend:
+                    return await cls.post_to_model_async(session, backend.url, payload)
+
+            return await async_retry_call(pooled_attempt, retries=retries, retry_on=retry_on)
+        if isinstance(model_url, (list, tuple)):
+            return await async_hedged_call(attempt, list(model_url), hedge_delay=hedge_delay)
+        return await attempt(model_url)
+
+    @classmethod
+    async def caption_image_async(cls, session, image_url, prompt_template, page_url, model_name, model_url):
+        """
+        Async counterpart of test_model_with_image_url_and_text. The image and the page
+        metadata are fetched concurrently on the given aiohttp session.
+        :return: The generated caption, or None if the model could not be reached.
+        """
+        # Cheap check that does not claim the half-open probe; that happens right before the model call
+        if llava_breaker.state == CircuitBreaker.OPEN:
+            print("LLaVA circuit breaker is open, skipping model call.")
+            return None
+
+        work_dir = tempfile.mkdtemp(prefix="llava_")
+        try:
+            image_path = os.path.join(work_dir, "image")
+            _, metadata = await asyncio.gather(
+                cls.download_image_to_file_async(session, image_url, image_path),
+                cls.gather_image_metadata_async(session, page_url),
+            )
+
+            # PIL work and payload writing are blocking, keep them off the event loop
+            jpeg_path = await asyncio.to_thread(cls.prepare_jpeg, image_path, os.path.join(work_dir, "image.jpg"))
+            full_prompt = cls.create_prompt(metadata, prompt_template)
+            payload = await asyncio.to_thread(
+                llava_payload, os.path.join(work_dir, "payload.json"), model_name, full_prompt, [jpeg_path]
+            )
+
+            if not llava_breaker.allow_request():
+                print("LLaVA circuit breaker is open, skipping model call.")
+                return None
+            try:
+                result = await cls.send_to_model_async(session, model_url, payload)
+            except Exception:
+                llava_breaker.record_failure()
+                raise
+            llava_breaker.record_success()
+            return result["response"]
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return None
+
+
+def is_complex_context(metadata, classifier=None, threshold=0.5):
+    """
+    Check if the metadata implies a complex image (like a diagram or scientific image).
+    With a ComplexityClassifier the decision uses its probability instead of keyword hits.
+    """
+    if classifier is not None:
+        probability = float(classifier.predict_proba([metadata])[0])
+        print(f"Complexity probability: {probability:.2f}")
+        return probability >= threshold
+
     # Get both the description and title from metadata (converted to lowercase)
     description = metadata.get("description", "").lower()
     title = metadata.get("title", "").lower()
 
     # Check if any of the complex keywords are present in either the description or title
-    if any(keyword in description for keyword in complex_keywords) or any(keyword in title for keyword in complex_keywords):
+    if any(keyword in description for keyword in COMPLEX_KEYWORDS) or any(keyword in title for keyword in COMPLEX_KEYWORDS):
         print("Description or title contains complex content, using LlavaImageCaptioner.")
         return True
     else:
@@ -338,44 +684,98 @@ def is_complex_context(metadata):
         return False
 
 
-
-def generate_captions(image_url, page_url, prompt_template, model_name, model_url):
+def generate_captions(image_url, page_url, prompt_template, model_name, model_url, ollama_pool=None, sink=None,
+                      classifier=None, profile=None):
     """
     Fetch metadata, select captioner, and generate a caption for the image.
+    model_url may be a single endpoint, a list of endpoints to hedge across, or a BackendPool;
+    ollama_pool is an optional BackendPool of Ollama hosts for MetadataImageCaptioner.
+    If a sink is given, a caption record with routing reason and stage latencies is written to it.
+    classifier is an optional ComplexityClassifier passed on to select_captioner.
+    profile is None, True or a profiling.Profiler; see profiling.start_profile.
     """
+    run = start_profile(profile, "generate_captions")
+    try:
+        return _generate_captions(image_url, page_url, prompt_template, model_name, model_url,
+                                  ollama_pool, sink, classifier, run)
+    finally:
+        run.finish()
+
+
+def _generate_captions(image_url, page_url, prompt_template, model_name, model_url, ollama_pool, sink, classifier,
+                       run):
+    latencies = {}
+
     # Initialize captioner
-    metadata_captioner = MetadataImageCaptioner(page_url)
+    metadata_captioner = MetadataImageCaptioner(page_url, backend_pool=ollama_pool)
 
     # Extract the filename from the image URL
     filename = os.path.basename(image_url)
 
     # Fetch metadata using the filename
-    metadata_text = metadata_captioner.gather_image_metadata(filename)
+    start = time.perf_counter()
+    with run.stage("metadata"):
+        metadata_text = metadata_captioner.gather_image_metadata(filename)
+    latencies["metadata"] = time.perf_counter() - start
     # Fix here: Use 'description' from metadata_text
     metadata = {"title": "No title", "description": metadata_text.get("description", "No description")}
 
     # Select appropriate captioner
-    Captioner = select_captioner(metadata, image_url)
+    start = time.perf_counter()
+    with run.stage("routing"):
+        Captioner, reason = select_captioner(metadata, image_url, return_reason=True, classifier=classifier)
+    latencies["routing"] = time.perf_counter() - start
 
+    caption = None
     if Captioner == LlavaImageCaptioner:
         print("Using LlavaImageCaptioner for full caption generation.")
-        LlavaImageCaptioner.test_model_with_image_url_and_text(
-            image_url, prompt_template, page_url, model_name, model_url
-        )
-    else:
+        start = time.perf_counter()
+        with run.stage("llava"):
+            caption = LlavaImageCaptioner.test_model_with_image_url_and_text(
+                image_url, prompt_template, page_url, model_name, model_url
+            )
+        latencies["llava"] = time.perf_counter() - start
+        if caption is None:
+            print("LlavaImageCaptioner unavailable, falling back to MetadataImageCaptioner.")
+            reason += ",llava_fallback"
+
+    if caption is None:
         print("Using MetadataImageCaptioner for simple caption generation.")
-        caption = metadata_captioner.generate_caption(metadata["title"], metadata["description"])
+        start = time.perf_counter()
+        with run.stage("caption"):
+            caption = metadata_captioner.generate_caption(metadata["title"], metadata["description"])
+        latencies["caption"] = time.perf_counter() - start
         print("Generated Caption:", caption)
+        Captioner = MetadataImageCaptioner
+
+    if sink is not None:
+        if Captioner == LlavaImageCaptioner:
+            model, prompt = model_name, get_template(prompt_template).full_text()
+        else:
+            model, prompt = metadata_captioner.model, metadata_captioner.template.full_text(metadata_captioner.system_prompt)
+        sink.write(make_record(image_url, caption, Captioner.__name__, routing_reason=reason,
+                               latencies=latencies, model=model, prompt=prompt))
+    return caption
 
 
 
 
 # Example usage:
-page_url = "https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/Images#/media/File:7.62x51_and_5.56x45_bullet_cartridges_compared_to_AA_battery.jpg"
-image_url = "https://upload.wikimedia.org/wikipedia/commons/3/31/7.62x51_and_5.56x45_bullet_cartridges_compared_to_AA_battery.jpg"
-    
-prompt_template = "Here is the information about the image: Title: {Title} Description: {Description}"
-model_name = "llama2"
-model_url = "https://model-api.example.com/endpoint"
-
-generate_captions(image_url, page_url, prompt_template, model_name, model_url)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a caption for one image.")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    page_url = "https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/Images#/media/File:7.62x51_and_5.56x45_bullet_cartridges_compared_to_AA_battery.jpg"
+    image_url = "https://upload.wikimedia.org/wikipedia/commons/3/31/7.62x51_and_5.56x45_bullet_cartridges_compared_to_AA_battery.jpg"
+
+    prompt_template = LLAVA_PROMPT
+    model_name = "llama2"
+    model_url = "https://model-api.example.com/endpoint"
+
+    warm_captioner = MetadataImageCaptioner(page_url)
+    print(f"TTFT before warm-up: {warm_captioner.measure_ttft()}")
+    print(f"Warm-up times: {warm_captioner.warm_up()}")
+    print(f"TTFT after warm-up: {warm_captioner.measure_ttft()}")
+
+    generate_captions(image_url, page_url, prompt_template, model_name, model_url, profile=profiler_from_args(args))
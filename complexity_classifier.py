@@ -0,0 +1,170 @@
+import re
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+# Single shared keyword list used by the keyword fallback in capt.py and final.py,
+# and as seed data for the classifier.
+COMPLEX_KEYWORDS = [
+    "data visualization", "visualizations", "data-driven images", "plots", "diagram", "chart",
+    "scientific", "technical", "graph", "medical", "research", "algorithm", "experiment", "data",
+    "simulation", "genetics", "chemistry", "physics", "map", "model", "equation", "code snippet",
+    "infographic", "flowchart", "study", "theory", "hypothesis", "analysis", "vector", "svg",
+    "historical", "geography", "archaeological", "expedition", "journal", "conference", "paper",
+    "patent", "published", "resolution",
+]
+
+# Negative seed examples: descriptions of ordinary photos.
+GENERAL_PHRASES = [
+    "portrait", "photograph of a person", "smiling man", "woman standing", "group photo", "actor",
+    "singer performing", "crowd", "building exterior", "street scene", "landscape", "mountain view",
+    "beach at sunset", "city skyline", "car parked", "dog", "cat", "flower", "tree", "house",
+    "family", "wedding", "football match", "poster", "film still", "album cover", "logo", "statue",
+    "church", "bridge", "river", "meeting", "prime minister", "president", "celebrity",
+]
+
+_TOKEN = re.compile(r"\w+")
+
+
+def _hash(feature, dim):
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dim, 1.0 if h & 0x80000000 else -1.0
+
+
+@lru_cache(maxsize=100000)
+def hashed_features(text, dim=2 ** 18, ngram_range=(3, 5)):
+    """
+    Hash word unigrams/bigrams and character n-grams of text into a sparse vector.
+    :return: (indices, values) arrays, L2-normalised. Results are cached per text.
+    """
+    words = _TOKEN.findall(text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    if not features:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    hashed = [_hash(f, dim) for f in features]
+    indices = np.fromiter((i for i, _ in hashed), dtype=np.int64, count=len(hashed))
+    values = np.fromiter((v for _, v in hashed), dtype=np.float32, count=len(hashed))
+    values /= np.sqrt(len(values))
+    return indices, values
+
+
+def metadata_text(metadata):
+    """Text the classifier looks at for a metadata record."""
+    return f"{metadata.get('title', '')} {metadata.get('description', '')}".strip()
+
+
+class ComplexityClassifier:
+    """
+    Logistic regression on metadata text that estimates how likely an image is to be
+    complex (diagram, chart, technical or historical content). The default "hashed"
+    backend uses hashed n-gram vectors and needs only NumPy. The "sentence-transformers"
+    backend embeds text with a small local model if that package is installed.
+    """
+
+    def __init__(self, backend="hashed", dim=2 ** 18, model_name="all-MiniLM-L6-v2"):
+        self.backend = backend
+        self.dim = dim
+        self._embedding_cache = {}
+        if backend == "hashed":
+            self._model = None
+        elif backend == "sentence-transformers":
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError(
+                    "The sentence-transformers backend requires: pip install sentence-transformers"
+                ) from e
+            self._model = SentenceTransformer(model_name, device="cpu")
+            self.dim = self._model.get_sentence_embedding_dimension()
+        else:
+            raise ValueError(f"Unknown backend {backend!r}")
+        self.weights = np.zeros(self.dim, dtype=np.float32)
+        self.bias = 0.0
+
+    @classmethod
+    def default(cls, prior=0.3, **kwargs):
+        """
+        Classifier trained on the built-in keyword seed data. The seed set is tiny and
+        balanced, so the bias is pinned to the given prior instead of being learned;
+        otherwise text with no known n-grams would score close to 0.5.
+        """
+        classifier = cls(**kwargs)
+        texts = COMPLEX_KEYWORDS + GENERAL_PHRASES
+        labels = [1] * len(COMPLEX_KEYWORDS) + [0] * len(GENERAL_PHRASES)
+        classifier.fit(texts, labels, epochs=1000, learning_rate=4.0, prior=prior)
+        return classifier
+
+    def _sparse_batch(self, texts):
+        """Concatenate cached hashed features of texts into flat arrays plus per-row lengths."""
+        rows = [hashed_features(text, self.dim) for text in texts]
+        lengths = np.array([len(indices) for indices, _ in rows], dtype=np.int64)
+        indices = np.concatenate([indices for indices, _ in rows]) if rows else np.zeros(0, dtype=np.int64)
+        values = np.concatenate([values for _, values in rows]) if rows else np.zeros(0, dtype=np.float32)
+        return indices, values, lengths
+
+    def _embed(self, texts):
+        """Dense embeddings for the sentence-transformers backend, cached per text."""
+        missing = list(dict.fromkeys(t for t in texts if t not in self._embedding_cache))
+        if missing:
+            vectors = self._model.encode(missing, batch_size=64, normalize_embeddings=True)
+            self._embedding_cache.update(zip(missing, vectors))
+        return np.stack([self._embedding_cache[t] for t in texts])
+
+    def _logits(self, texts):
+        if self.backend != "hashed":
+            return self._embed(texts) @ self.weights + self.bias
+        indices, values, lengths = self._sparse_batch(texts)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        return self.bias + np.bincount(rows, weights=self.weights[indices] * values, minlength=len(texts))
+
+    def fit(self, texts, labels, epochs=200, learning_rate=0.5, l2=1e-4, prior=None):
+        """
+        Train with full-batch gradient descent on the logistic loss.
+        :param prior: If given, fix the bias at logit(prior) instead of learning it.
+        """
+        labels = np.asarray(labels, dtype=np.float64)
+        if prior is not None:
+            self.bias = float(np.log(prior / (1 - prior)))
+        n = len(texts)
+        if self.backend == "hashed":
+            indices, values, lengths = self._sparse_batch(texts)
+            rows = np.repeat(np.arange(n), lengths)
+        else:
+            matrix = self._embed(texts)
+        for _ in range(epochs):
+            errors = 1.0 / (1.0 + np.exp(-self._logits(texts))) - labels
+            if self.backend == "hashed":
+                gradient = np.bincount(indices, weights=errors[rows] * values, minlength=self.dim)
+            else:
+                gradient = matrix.T @ errors
+            self.weights -= (learning_rate * (gradient / n + l2 * self.weights)).astype(np.float32)
+            if prior is None:
+                self.bias -= learning_rate * errors.mean()
+        return self
+
+    def predict_proba(self, records):
+        """
+        Complexity probability for a batch of metadata dictionaries (or plain strings).
+        :return: Array of probabilities, one per record.
+        """
+        texts = [r if isinstance(r, str) else metadata_text(r) for r in records]
+        return 1.0 / (1.0 + np.exp(-self._logits(texts)))
+
+    def save(self, path):
+        """Save the trained weights to a .npz file."""
+        np.savez(path, weights=self.weights, bias=self.bias, backend=self.backend, dim=self.dim)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Load weights saved with save()."""
+        data = np.load(path)
+        classifier = cls(backend=str(data["backend"]), dim=int(data["dim"]), **kwargs)
+        classifier.weights = data["weights"]
+        classifier.bias = float(data["bias"])
+        return classifier
@@ -3,13 +3,17 @@ import warnings
 import requests
 import base64
 import io
-import json
 from bs4 import BeautifulSoup
 from PIL import Image
 
 import requests
 from io import BytesIO
 
+import capt
+from complexity_classifier import COMPLEX_KEYWORDS
+from prompts import get_template
+from streaming import dumps
+
 warnings.filterwarnings("ignore")
 
 
@@ -20,6 +24,7 @@ class MetadataImageCaptioner:
         self.image_data = []
         self.captions = {}
         self.prompt_template = prompt_template
+        self.template = get_template(prompt_template)  # Validated once, not on every caption
 
     def fetch_content(self, url):
         """Fetch the HTML content of a webpage."""
@@ -58,7 +63,6 @@ class MetadataImageCaptioner:
 
     def generate_caption(self, context, full_description):
         """Generate a caption for an image using a placeholder model."""
-        prompt = self.prompt_template.format(Title=context, Description=full_description)
         response = f"Generated caption for '{context}': {full_description[:50]}..."
         return response
 
@@ -74,7 +78,7 @@ class LlavaImageCaptioner:
     @staticmethod
     def download_image(url):
         """Downloads an image from a URL and returns a PIL Image object."""
-        response = requests.get(url)
+        response = requests.get(url, timeout=capt.STAGE_TIMEOUTS["image"])
         if response.status_code == 200:
             return Image.open(io.BytesIO(response.content))
         else:
@@ -93,7 +97,7 @@ class LlavaImageCaptioner:
         """Dynamically inserts metadata into the provided prompt template."""
         title = metadata.get("title", "No title")
         description = metadata.get("description", "No description")
-        return prompt_template.format(Title=title, Description=description)
+        return get_template(prompt_template).render({"title": title, "description": description})
 
     @classmethod
     def test_model_with_image_url_and_text(cls, image_url, prompt_template, page_url, model_name, model_url):
@@ -114,7 +118,7 @@ class LlavaImageCaptioner:
             print(full_prompt)
 
             # Define the payload
-            payload = json.dumps(
+            payload = dumps(
                 {
                     "model": model_name,
                     "prompt": full_prompt,
@@ -123,15 +127,24 @@ class LlavaImageCaptioner:
                 }
             )
 
-            # Send the request to the model API
-            response = requests.post(model_url, data=payload, headers={"Content-Type": "application/json"})
+            # Send the request to the model API, with capt's timeouts, retries and shared breaker
+            if not capt.llava_breaker.allow_request():
+                print("LLaVA circuit breaker is open, skipping model call.")
+                return
+            try:
+                response = capt.LlavaImageCaptioner.send_to_model(model_url, payload)
+            except Exception:
+                capt.llava_breaker.record_failure()
+                raise
 
             # Check if the request was successful
             if response.status_code == 200:
+                capt.llava_breaker.record_success()
                 result = response.json()
                 print("Response from model:")
                 print(result["response"])
             else:
+                capt.llava_breaker.record_failure()
                 print(f"Error: Received status code {response.status_code}")
                 print(response.text)
 
@@ -202,13 +215,10 @@ def is_high_resolution(image_url, min_width=800, min_height=600):
 
 def is_complex_context(metadata):
     """Check if the metadata implies a complex image (like a diagram or scientific image)."""
-    # Keywords related to complex or technical content
-    complex_keywords = ["diagram", "chart", "scientific", "technical", "graph", "medical", "research","Delhi"]
-    
     description = metadata.get("description", "").lower()
     
-    # Check if any of the complex keywords are present in the description
-    if any(keyword in description for keyword in complex_keywords):
+    # Check if any of the shared complex keywords are present in the description
+    if any(keyword in description for keyword in COMPLEX_KEYWORDS):
         print("Description contains complex content, using LlavaImageCaptioner.")
         return True
     else:
@@ -0,0 +1,153 @@
+from io import BytesIO
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+import requests
+from PIL import Image
+
+THUMBNAIL_SIZE = (64, 64)
+
+# Weights of each feature in the content complexity score, fitted (logistic regression,
+# rescaled so 0.5 is the decision boundary) on labelled thumbnails of photos, icons,
+# blank images, charts and scans. Diagrams, charts and scans have few colours and text;
+# a mostly flat image with nothing on it is a blank or an icon, not a scan.
+FEATURE_WEIGHTS = {
+    "colour_entropy": -1.44,
+    "edge_density": -0.33,
+    "text_likeness": 0.36,
+    "flat_background": -0.77,
+}
+SCORE_BIAS = 1.20
+
+# Limits for scoring originals from hosts without server-side thumbnails, so a large
+# file is skipped instead of being buffered and decoded whole.
+MAX_SCORE_BYTES = 2 * 1024 * 1024
+MAX_SCORE_PIXELS = 4 * 1024 * 1024
+
+
+def thumbnail_url(image_url, width=128):
+    """Return the URL of a small Wikimedia-rendered thumbnail, or the original URL for other hosts."""
+    parsed = urlparse(image_url)
+    if parsed.netloc != "upload.wikimedia.org":
+        return image_url
+    parts = parsed.path.split("/")
+    if "thumb" in parts:
+        # Already a thumbnail: swap the width prefix of the last segment
+        name = parts[-2]
+        parts[-1] = f"{width}px-{name}"
+    else:
+        # /wikipedia/commons/3/31/Name.jpg -> /wikipedia/commons/thumb/3/31/Name.jpg/128px-Name.jpg
+        name = parts[-1]
+        parts = parts[:3] + ["thumb"] + parts[3:] + [f"{width}px-{name}"]
+    if unquote(name).lower().endswith(".svg"):
+        parts[-1] += ".png"
+    return parsed._replace(path="/".join(parts)).geturl()
+
+
+def load_thumbnail(source, size=THUMBNAIL_SIZE):
+    """
+    Decode an image (path, bytes or PIL image) to a size[1] x size[0] x 3 uint8 array.
+    JPEGs are decoded at reduced scale, so large files stay cheap.
+    """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+    image.draft("RGB", size)
+    return np.asarray(image.convert("RGB").resize(size, Image.BILINEAR), dtype=np.uint8)
+
+
+def extract_features(batch, edge_threshold=32, flat_threshold=4):
+    """
+    Compute content features for a batch of thumbnails in one set of array operations.
+    :param batch: uint8 array of shape (N, H, W, 3).
+    :return: Dictionary of float arrays of shape (N,), each in [0, 1].
+    """
+    batch = np.asarray(batch, dtype=np.uint8)
+    n = batch.shape[0]
+
+    # Colour entropy over a 3-bit-per-channel histogram (512 bins), normalised by log2(512)
+    quantized = batch >> 5
+    codes = (quantized[..., 0].astype(np.int64) << 6) | (quantized[..., 1] << 3) | quantized[..., 2]
+    codes = codes.reshape(n, -1) + np.arange(n)[:, None] * 512
+    counts = np.bincount(codes.ravel(), minlength=n * 512).reshape(n, 512)
+    p = counts / counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1) / 9.0
+
+    # Gradients on the greyscale image
+    grey = batch @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    dx = np.abs(np.diff(grey, axis=2))[:, :-1, :]
+    dy = np.abs(np.diff(grey, axis=1))[:, :, :-1]
+    gradient = np.maximum(dx, dy)
+    edge_density = (gradient > edge_threshold).mean(axis=(1, 2))
+    flat_background = (gradient < flat_threshold).mean(axis=(1, 2))
+
+    # Text-likeness: rows of binarised pixels that flip often (strokes), weighted by how
+    # much of the image is near pure ink or paper
+    binary = grey > grey.mean(axis=(1, 2), keepdims=True)
+    transitions = (binary[:, :, 1:] != binary[:, :, :-1]).mean(axis=2)
+    stroke_rows = ((transitions > 0.08) & (transitions < 0.5)).mean(axis=1)
+    extremes = ((grey < 64) | (grey > 192)).mean(axis=(1, 2))
+    text_likeness = stroke_rows * extremes
+
+    return {
+        "colour_entropy": entropy,
+        "edge_density": edge_density,
+        "text_likeness": text_likeness,
+        "flat_background": flat_background,
+    }
+
+
+def complexity_scores(features, weights=FEATURE_WEIGHTS, bias=SCORE_BIAS):
+    """Combine features into one score per image in [0, 1]; higher means more diagram-like."""
+    score = np.full_like(next(iter(features.values())), bias, dtype=np.float64)
+    for name, weight in weights.items():
+        score += weight * features[name]
+    return np.clip(score, 0.0, 1.0)
+
+
+def score_thumbnails(sources, size=THUMBNAIL_SIZE):
+    """Decode a list of images and return their complexity scores as an array."""
+    if not sources:
+        return np.zeros(0)
+    batch = np.stack([load_thumbnail(source, size) for source in sources])
+    return complexity_scores(extract_features(batch))
+
+
+def read_capped(response, max_bytes, chunk_size=64 * 1024):
+    """Read a streamed response body, returning None as soon as it exceeds max_bytes."""
+    length = response.headers.get("Content-Length")
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        return None
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size):
+        body += chunk
+        if len(body) > max_bytes:
+            return None
+    return bytes(body)
+
+
+def image_content_score(image_url, timeout=(3.05, 15), max_bytes=MAX_SCORE_BYTES, max_pixels=MAX_SCORE_PIXELS):
+    """
+    Fetch a small thumbnail of the image and return its complexity score, or None on failure.
+    Hosts without server-side thumbnails serve the original; it is scored only if it is
+    at most max_bytes long and, unless it is a JPEG (decoded at reduced scale), at most
+    max_pixels large.
+    """
+    try:
+        with requests.get(thumbnail_url(image_url), timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                print(f"Failed to download thumbnail for {image_url}")
+                return None
+            body = read_capped(response, max_bytes)
+        if body is None:
+            print(f"Skipping content scoring for {image_url}: larger than {max_bytes} bytes")
+            return None
+        image = Image.open(BytesIO(body))
+        if image.format != "JPEG" and image.width * image.height > max_pixels:
+            print(f"Skipping content scoring for {image_url}: {image.width}x{image.height} is too large to decode")
+            return None
+        return float(score_thumbnails([image])[0])
+    except Exception as e:
+        print(f"Error scoring image content for {image_url}: {e}")
+    return None
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import os
+
+
+def file_sha1(path, chunk_size=1024 * 1024):
+    """SHA-1 of a file, read in chunks."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CaptionState:
+    """
+    Record of what previous runs saw for each article: its revision ID and, per image,
+    the ETag, SHA-1 and caption. Stored as a single JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.articles = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.articles = json.load(f)
+
+    def article(self, url):
+        """Return the stored entry for an article, or an empty one."""
+        return self.articles.get(url, {"revision_id": None, "images": {}})
+
+    def update_article(self, url, revision_id, images):
+        """Replace the stored entry for an article."""
+        self.articles[url] = {"revision_id": revision_id, "images": images}
+
+    def save(self):
+        """Write the state file atomically."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.articles, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def diff_captions(old_images, new_images):
+    """
+    Compare two {image_url: {"sha1", "caption", ...}} mappings. Entries without a
+    caption (images whose download failed) are ignored.
+    :return: Dictionary with "added", "removed" and "changed" captions.
+    """
+    old_images = {url: entry for url, entry in old_images.items() if entry.get("caption") is not None}
+    new_images = {url: entry for url, entry in new_images.items() if entry.get("caption") is not None}
+    added = {url: entry["caption"] for url, entry in new_images.items() if url not in old_images}
+    removed = {url: entry["caption"] for url, entry in old_images.items() if url not in new_images}
+    changed = {
+        url: {"old": old_images[url]["caption"], "new": entry["caption"]}
+        for url, entry in new_images.items()
+        if url in old_images and (
+            entry.get("sha1") != old_images[url].get("sha1") or entry["caption"] != old_images[url]["caption"]
+        )
+    }
+    return {"added": added, "removed": removed, "changed": changed}
@@ -0,0 +1,388 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+from PIL import Image
+
+import capt
+import metaimg
+from backends import BackendPool
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Local stand-in for Wikimedia, the LLaVA HTTP endpoint and Ollama, with injectable
+    latency, server errors and 429s. Counts every response by status code.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, images_per_page=50):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.images_per_page = images_per_page
+        self.counts = {}
+        self._lock = threading.Lock()
+        self.image_bytes = _make_test_image()
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, status):
+        with self._lock:
+            self.counts[str(status)] = self.counts.get(str(status), 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (e.g. after reading only an image header) are expected
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def _make_test_image(width=800, height=600):
+    """A gradient JPEG, so routing and thumbnail scoring see a photo-like image."""
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _inject(self):
+        """Sleep for the configured latency and maybe fail; returns True if a failure was sent."""
+        server = self.server
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        roll = random.random()
+        if roll < server.error_rate:
+            self._send(500, b'{"error": "injected"}')
+            return True
+        if roll < server.error_rate + server.throttle_rate:
+            self._send(429, b'{"error": "slow down"}', headers={"Retry-After": "1"})
+            return True
+        return False
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        if self._inject():
+            return
+        path = unquote(urlparse(self.path).path)
+        if path.startswith("/images/"):
+            etag = hashlib.sha1(path.encode("utf-8")).hexdigest()
+            self._send(200, self.server.image_bytes, "image/jpeg", headers={"ETag": f'"{etag}"'})
+        elif path.startswith("/wiki/File:"):
+            self._send(200, _file_page(path[len("/wiki/File:"):]).encode("utf-8"), "text/html")
+        elif path.startswith("/wiki/"):
+            self._send(200, _article_page(self.server).encode("utf-8"), "text/html")
+        elif path == "/w/api.php":
+            self._send(200, json.dumps({"query": {"pages": [{"revisions": [{"revid": random.randint(1, 10 ** 9)}]}]}}).encode())
+        else:
+            self._send(200, b"ok", "text/plain")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self._inject():
+            return
+        body = {
+            "model": "stub",
+            "created_at": "2024-01-01T00:00:00Z",
+            "response": "A stub caption of the image.",
+            "done": True,
+        }
+        self._send(200, json.dumps(body).encode("utf-8"))
+
+
+def _file_page(filename):
+    # About a third of the files get a short description, which routes them to LLaVA
+    short = int(hashlib.md5(filename.encode("utf-8")).hexdigest(), 16) % 3 == 0
+    description = "A photo." if short else "A photograph of a person standing in front of a building on a sunny day."
+    return (
+        f'<html><body><h1 id="firstHeading">File:{filename}</h1>'
+        f'<div class="description"><p>{description}</p></div></body></html>'
+    )
+
+
+def _article_page(server):
+    images = "".join(
+        f'<img src="//127.0.0.1:{server.server_address[1]}/images/Test_image_{i}.jpg" alt="Test image {i}">'
+        for i in range(server.images_per_page)
+    )
+    return f"<html><body>{images}</body></html>"
+
+
+def point_pipeline_at(base_url):
+    """Redirect the captioning modules' Wikimedia URLs to the stub server at base_url."""
+    capt.FILE_PAGE_URLS = [f"{base_url}/wiki/File:"]
+    metaimg.FILE_PAGE_URLS = [f"{base_url}/wiki/File:"]
+    metaimg.IMAGE_HOSTS = (urlparse(base_url).netloc,)
+
+
+class MemorySink:
+    """Sink that keeps records in a list, along with the time each one was written."""
+
+    def __init__(self):
+        self.records = []
+        self.written_at = []
+
+    def write(self, record):
+        self.records.append(record)
+        self.written_at.append(time.perf_counter())
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KiB, where the platform reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def current_rss_kb():
+    """Current resident set size of this process in KiB (Linux only), or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """
+    Samples the current RSS in a background thread to find the peak during a block.
+    Unlike ru_maxrss it is not dominated by earlier peaks such as module imports.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.baseline = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while True:
+            rss = current_rss_kb()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            if self._stop.wait(self.interval):
+                break
+
+    def __enter__(self):
+        self.baseline = current_rss_kb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def _summarize(entry, concurrency, latencies, errors, elapsed, items=None, fallbacks=None):
+    items = len(latencies) if items is None else items
+    return {
+        "entry_point": entry,
+        "concurrency": concurrency,
+        "requests": items,
+        "seconds": elapsed,
+        "throughput_per_s": items / elapsed if elapsed else None,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "error_rate": errors / items if items else None,
+        # Calls that succeeded only by falling back from LLaVA to the metadata captioner
+        "fallback_rate": fallbacks / items if items and fallbacks is not None else None,
+    }
+
+
+def run_generate_captions(base_url, concurrency, requests_per_step):
+    """
+    Call generate_captions from concurrency threads and time each call. Failed calls
+    count towards error_rate; calls rescued by the LLaVA fallback towards fallback_rate.
+    """
+    pool = BackendPool.from_urls([base_url], max_concurrency=concurrency)
+    sink = MemorySink()
+    prompt_template = "Title: {Title} Description: {Description}"
+    capt.llava_breaker.record_success()
+
+    def one(i):
+        image_url = f"{base_url}/images/Load_test_{i}.jpg"
+        start = time.perf_counter()
+        caption = capt.generate_captions(
+            image_url, f"{base_url}/wiki/File:Load_test_{i}.jpg", prompt_template,
+            "stub", f"{base_url}/api/generate", ollama_pool=pool, sink=sink,
+        )
+        return time.perf_counter() - start, caption == "Caption generation failed."
+
+    # Injected errors can mark the stub unhealthy; health checks bring it back as in production
+    pool.start_health_checks(interval=1.0)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests_per_step)))
+    elapsed = time.perf_counter() - start
+    pool.stop_health_checks()
+    latencies = [latency for latency, _ in results]
+    errors = sum(failed for _, failed in results)
+    fallbacks = sum("llava_fallback" in (record["routing_reason"] or "") for record in sink.records)
+    return _summarize("generate_captions", concurrency, latencies, errors, elapsed, fallbacks=fallbacks)
+
+
+def run_process_images(base_url, concurrency):
+    """
+    Run metaimg's async process_images on a stub article with concurrency images.
+    Each image's latency runs from the start of the call until its record is written,
+    so the page fetch and download are included.
+    """
+    captioner = metaimg.MetadataImageCaptioner(f"{base_url}/wiki/Load_test", "{context} {full_description}")
+    sink = MemorySink()
+    start = time.perf_counter()
+    asyncio.run(captioner.process_images(sink=sink))
+    elapsed = time.perf_counter() - start
+    latencies = [written - start for written in sink.written_at]
+    errors = concurrency - len(sink.records)
+    return _summarize("process_images", concurrency, latencies, errors, elapsed, items=concurrency)
+
+
+def _run_step(entry, base_url, concurrency, requests_per_step, verbose):
+    """Run one step inside a fresh worker process, so its memory figures are its own."""
+    point_pipeline_at(base_url)
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet, RssSampler() as rss:
+        if entry == "generate_captions":
+            step = run_generate_captions(base_url, concurrency, requests_per_step)
+        else:
+            step = run_process_images(base_url, concurrency)
+    step["peak_rss_kb"] = rss.peak if rss.peak is not None else peak_rss_kb()
+    step["rss_growth_kb"] = rss.peak - rss.baseline if rss.peak is not None else None
+    return step
+
+
+def run_step(server, entry, concurrency, requests_per_step, verbose=False):
+    """Run one step in a new process against the stub server and add the stub's response counts."""
+    server.images_per_page = concurrency
+    server.reset_counts()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        step = executor.submit(_run_step, entry, server.base_url, concurrency, requests_per_step, verbose).result()
+    step["stub_responses"] = server.reset_counts()
+    return step
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(report, baseline):
+    """Print throughput and p95 changes against a previous report."""
+    previous = {(s["entry_point"], s["concurrency"]): s for s in baseline["steps"]}
+    for step in report["steps"]:
+        old = previous.get((step["entry_point"], step["concurrency"]))
+        if not old:
+            continue
+        for key in ("throughput_per_s", "p95_s", "error_rate", "fallback_rate"):
+            if old.get(key) and step.get(key) is not None:
+                change = (step[key] - old[key]) / old[key] * 100
+                print(f"{step['entry_point']} c={step['concurrency']} {key}: {old[key]:.3f} -> {step[key]:.3f} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the captioning stack against local stub servers.")
+    parser.add_argument("--concurrency", default="50,100,200,500", help="Comma-separated concurrency steps.")
+    parser.add_argument("--requests-per-step", type=int, default=None, help="generate_captions calls per step (default 2x concurrency).")
+    parser.add_argument("--entry-points", default="generate_captions,process_images")
+    parser.add_argument("--latency", type=float, default=0.02, help="Stub latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Extra random stub latency in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub responses that are 500s.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of stub responses that are 429s.")
+    parser.add_argument("--output", default="loadtest_report.json")
+    parser.add_argument("--compare", help="Previous report to compare against.")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output.")
+    args = parser.parse_args(argv)
+
+    server = StubServer(args.latency, args.jitter, args.error_rate, args.throttle_rate).start()
+    entry_points = args.entry_points.split(",")
+    steps = []
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        for entry in ("generate_captions", "process_images"):
+            if entry in entry_points:
+                step = run_step(server, entry, concurrency, args.requests_per_step or 2 * concurrency, args.verbose)
+                steps.append(step)
+                print(json.dumps(step))
+    server.shutdown()
+
+    report = {
+        "commit": current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "steps": steps,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    main()
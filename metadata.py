@@ -1,11 +1,18 @@
+import argparse
 import asyncio
 import os
 import shutil
 import warnings
 
 import aiohttp
+import httpx
 import requests
 from bs4 import BeautifulSoup
+
+from capt import OLLAMA_KEEP_ALIVE, STAGE_TIMEOUTS
+from profiling import add_profile_arguments, profiler_from_args, start_profile
+from prompts import TEMPLATES, ollama_request
+from streaming import stream_aiohttp_response_to_file
 import ollama
 
 warnings.filterwarnings("ignore")
@@ -47,8 +54,7 @@ class WikipediaImageScrapper:
                 if response.status == 200:
                     filename = os.path.basename(url)
                     file_path = os.path.join("images_wiki", filename)
-                    with open(file_path, "wb") as f:
-                        f.write(await response.read())
+                    await stream_aiohttp_response_to_file(response, file_path)
                     return file_path, url
         except Exception as e:
             print(f"Error downloading image from {url}: {e}")
@@ -67,17 +73,19 @@ class MetadataImageCaptioner:
         self.url = url
         self.image_folder = "images_wiki"
         self.captions = {}
+        connect, read = STAGE_TIMEOUTS["model"]
+        self.client = ollama.Client(timeout=httpx.Timeout(read, connect=connect))
 
     def generate_caption(self, context, full_description):
         """Generate a caption for an image using the LLM model."""
-        prompt = (
-            "You are an intelligent assistant. Based on the given title and metadata, "
-            "generate a descriptive caption for the image. Title: {context}. Metadata: {full_description}."
-        ).format(context=context, full_description=full_description)
+        template = TEMPLATES["caption"]
+        prompt = template.render({"title": context, "description": full_description})
 
         try:
             print("Generated prompt:", prompt)  # Debugging
-            response = ollama.generate(model="wizardlm2", prompt=prompt)
+            response = self.client.generate(**ollama_request(
+                "wizardlm2", prompt, system=template.system, keep_alive=OLLAMA_KEEP_ALIVE
+            ))
             return response.get("response", "No response generated.")
         except Exception as e:
             print(f"Error generating caption: {e}")
@@ -87,7 +95,7 @@ class MetadataImageCaptioner:
         """Gather metadata about an image from Wikimedia or Wikipedia."""
         for base_url in ["https://commons.wikimedia.org/wiki/File:", "https://en.wikipedia.org/wiki/File:"]:
             try:
-                response = requests.get(base_url + filename)
+                response = requests.get(base_url + filename, timeout=STAGE_TIMEOUTS["metadata"])
                 if response.status_code == 200:
                     soup = BeautifulSoup(response.content, "html.parser")
                     title = soup.find("h1", {"id": "firstHeading"}).get_text(strip=True) if soup.find("h1", {"id": "firstHeading"}) else "Unknown Title"
@@ -97,18 +105,32 @@ class MetadataImageCaptioner:
                 print(f"Error fetching metadata: {e}")
         return "Unknown Title", "No metadata found."
 
-    async def process_single_image(self, image_url):
-        """Process a single image URL asynchronously and return a dictionary with the image URL as the key and the generated caption as the value."""
+    async def process_single_image(self, image_url, profile=None):
+        """
+        Process a single image URL asynchronously and return a dictionary with the image URL as the key and the generated caption as the value.
+        profile is None, True or a profiling.Profiler; see profiling.start_profile.
+        """
+        run = start_profile(profile, "process_single_image")
+        run.watch_event_loop()
+        try:
+            return await self._process_single_image(image_url, run)
+        finally:
+            run.finish()
+
+    async def _process_single_image(self, image_url, run):
         async with aiohttp.ClientSession() as session:
             os.makedirs(self.image_folder, exist_ok=True)
             scrapper = WikipediaImageScrapper(self.url)
-            file_path, url = await scrapper.download_image(session, image_url)
+            with run.stage("download"):
+                file_path, url = await scrapper.download_image(session, image_url)
             if not file_path:
                 return {}
 
             filename = os.path.basename(file_path)
-            title, metadata = self.gather_image_metadata(filename)
-            caption = self.generate_caption(title, full_description=metadata)
+            with run.stage("metadata"):
+                title, metadata = self.gather_image_metadata(filename)
+            with run.stage("caption"):
+                caption = self.generate_caption(title, full_description=metadata)
             self.captions[url] = caption
 
             shutil.rmtree(self.image_folder, ignore_errors=True)
@@ -116,11 +138,18 @@ class MetadataImageCaptioner:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caption a single image.")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
     path = "https://en.wikipedia.org/wiki/James_Bond"
     scrapper = WikipediaImageScrapper(path)
     cap = MetadataImageCaptioner(path)
 
     single_image_caption = asyncio.run(
-        cap.process_single_image("https://upload.wikimedia.org/wikipedia/commons/c/c3/Hoagy_Carmichael_-_1947.jpg")
+        cap.process_single_image(
+            "https://upload.wikimedia.org/wikipedia/commons/c/c3/Hoagy_Carmichael_-_1947.jpg",
+            profile=profiler_from_args(args),
+        )
     )
     print(single_image_caption)
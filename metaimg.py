@@ -1,14 +1,28 @@
+import argparse
 import asyncio
 import os
 import shutil
+import time
 import warnings
+from urllib.parse import unquote, urljoin, urlparse
 
 import aiohttp
 import requests
 from bs4 import BeautifulSoup
 
+from incremental import CaptionState, diff_captions, file_sha1
+from profiling import add_profile_arguments, profiler_from_args, start_profile
+from prompts import get_template
+from sinks import make_record
+from streaming import stream_aiohttp_response_to_file
+
 warnings.filterwarnings("ignore")
 
+# File description pages tried, in order, when gathering image metadata.
+FILE_PAGE_URLS = ["https://commons.wikimedia.org/wiki/File:", "https://en.wikipedia.org/wiki/File:"]
+# Hosts whose <img> tags are treated as article images.
+IMAGE_HOSTS = ("upload.wikimedia.org",)
+
 
 class MetadataImageCaptioner:
     def __init__(self, url, prompt_template):
@@ -17,6 +31,8 @@ class MetadataImageCaptioner:
         self.image_data = []
         self.captions = {}
         self.prompt_template = prompt_template
+        self.template = get_template(prompt_template)
+        self.diff = None
 
     async def fetch_content(self, session, url):
         """Fetch the HTML content of a webpage."""
@@ -33,8 +49,8 @@ class MetadataImageCaptioner:
         images = []
         for img_tag in soup.find_all("img"):
             img_src = img_tag.get("src")
-            if img_src and img_src.startswith("//upload.wikimedia.org"):
-                img_link = "https:" + img_src
+            if img_src and urlparse(urljoin(self.url, img_src)).netloc in IMAGE_HOSTS:
+                img_link = urljoin(self.url, img_src)
                 description = img_tag.get("alt", "No description available")
                 images.append({"link": img_link, "description": description})
         return images
@@ -46,8 +62,7 @@ class MetadataImageCaptioner:
                 if response.status == 200:
                     filename = os.path.basename(url)
                     filepath = os.path.join(self.image_folder, filename)
-                    with open(filepath, "wb") as f:
-                        f.write(await response.read())
+                    await stream_aiohttp_response_to_file(response, filepath)
                     return filepath, url
         except Exception as e:
             print(f"Error downloading image {url}: {e}")
@@ -55,14 +70,13 @@ class MetadataImageCaptioner:
 
     def generate_caption(self, context, full_description):
         """Generate a caption for an image using a placeholder model."""
-        prompt = self.prompt_template.format(context=context, full_description=full_description)
-        # Placeholder response; replace with actual model API call as needed
+        # Placeholder response; replace with a model call on self.template.render(...) as needed
         response = f"Generated caption for '{context}': {full_description[:50]}..."  # Simulated response
         return response
 
     def gather_image_metadata(self, filename):
         """Fetch metadata about an image from Wikimedia or Wikipedia."""
-        for base_url in ["https://commons.wikimedia.org/wiki/File:", "https://en.wikipedia.org/wiki/File:"]:
+        for base_url in FILE_PAGE_URLS:
             try:
                 response = requests.get(base_url + filename)
                 if response.status_code == 200:
@@ -72,41 +86,175 @@ class MetadataImageCaptioner:
                 print(f"Error gathering metadata: {e}")
         return ""
 
-    async def process_images(self, show=False):
-        """Fetch images from the URL, download them, and generate captions."""
+    async def fetch_revision_id(self, session):
+        """Fetch the current revision ID of the article through the MediaWiki API."""
+        parsed = urlparse(self.url)
+        title = unquote(parsed.path.rsplit("/wiki/", 1)[-1])
+        api_url = f"{parsed.scheme}://{parsed.netloc}/w/api.php"
+        params = {
+            "action": "query", "prop": "revisions", "rvprop": "ids",
+            "titles": title, "format": "json", "formatversion": "2",
+        }
+        try:
+            async with session.get(api_url, params=params) as response:
+                if response.status == 200:
+                    data = await response.json(content_type=None)
+                    return data["query"]["pages"][0]["revisions"][0]["revid"]
+        except Exception as e:
+            print(f"Error fetching revision ID for {self.url}: {e}")
+        return None
+
+    async def fetch_etag(self, session, url):
+        """Fetch the ETag of an image with a HEAD request."""
+        try:
+            async with session.head(url) as response:
+                if response.status == 200:
+                    return response.headers.get("ETag")
+        except Exception as e:
+            print(f"Error fetching ETag for {url}: {e}")
+        return None
+
+    async def process_images(self, show=False, sink=None, state_path=None, profile=None):
+        """
+        Fetch images from the URL, download them, and generate captions.
+        If a sink is given, each caption record is streamed to it as soon as it is produced
+        instead of being collected in self.captions.
+        If state_path is given, the article revision and each image's ETag and SHA-1 are
+        recorded there, and later runs only process images that were added or changed.
+        The added/removed/changed captions of the run are stored in self.diff.
+        profile is None, True or a profiling.Profiler; see profiling.start_profile.
+        """
+        run = start_profile(profile, "process_images")
+        run.watch_event_loop()
+        try:
+            return await self._process_images(show, sink, state_path, run)
+        finally:
+            run.finish()
+
+    async def _process_images(self, show, sink, state_path, run):
+        state = CaptionState(state_path) if state_path else None
+        previous = state.article(self.url) if state else {"revision_id": None, "images": {}}
+        previous_images = previous["images"]
+        current_images = {}
+
         async with aiohttp.ClientSession() as session:
-            html_content = await self.fetch_content(session, self.url)
-            if not html_content:
-                return {}
-            
-            self.image_data = self.extract_images(html_content)
+            revision_id = None
+            revision_unchanged = False
+            if state:
+                revision_id = await self.fetch_revision_id(session)
+                revision_unchanged = revision_id is not None and revision_id == previous["revision_id"]
+
+            if revision_unchanged:
+                # Same article text, so the same images. A file re-uploaded under the same
+                # name does not change the revision, so the ETags are still checked below.
+                print(f"Revision {revision_id} unchanged, only checking images of {self.url}")
+                self.image_data = [
+                    {"link": url, "description": entry.get("description", "Description not found.")}
+                    for url, entry in previous_images.items()
+                ]
+            else:
+                with run.stage("fetch_page"):
+                    html_content = await self.fetch_content(session, self.url)
+                if not html_content:
+                    return {}
+                self.image_data = self.extract_images(html_content)
             os.makedirs(self.image_folder, exist_ok=True)
-            
-            tasks = [self.download_image(session, img["link"]) for img in self.image_data]
-            download_results = await asyncio.gather(*tasks)
+
+            to_process = self.image_data
+            etags = {}
+            if state:
+                with run.stage("etags"):
+                    results = await asyncio.gather(*[self.fetch_etag(session, img["link"]) for img in self.image_data])
+                etags = {img["link"]: etag for img, etag in zip(self.image_data, results)}
+                to_process = []
+                for img in self.image_data:
+                    old = previous_images.get(img["link"])
+                    if old and etags[img["link"]] and old.get("etag") == etags[img["link"]]:
+                        current_images[img["link"]] = old
+                    else:
+                        to_process.append(img)
+                print(f"{len(to_process)} of {len(self.image_data)} images are new or changed.")
+
+            tasks = [self.download_image(session, img["link"]) for img in to_process]
+            with run.stage("download"):
+                download_results = await asyncio.gather(*tasks)
 
             for file_path, url in download_results:
                 if file_path:
                     filename = os.path.basename(file_path)
-                    full_info = self.gather_image_metadata(filename)
+                    sha1 = file_sha1(file_path) if state else None
+                    old = previous_images.get(url)
+                    if old and old.get("sha1") == sha1:
+                        # Only the ETag changed, the image itself is the same
+                        current_images[url] = dict(old, etag=etags.get(url))
+                        continue
+
+                    start = time.perf_counter()
+                    with run.stage("metadata"):
+                        full_info = self.gather_image_metadata(filename)
+                    metadata_time = time.perf_counter() - start
                     clean_name = os.path.splitext(filename)[0]
                     description = next(
                         (img["description"] for img in self.image_data if img["link"] == url),
                         "Description not found."
                     )
-                    caption = self.generate_caption(f"{clean_name} {description}", full_description=full_info)
+                    start = time.perf_counter()
+                    with run.stage("caption"):
+                        caption = self.generate_caption(f"{clean_name} {description}", full_description=full_info)
+                    caption_time = time.perf_counter() - start
                     if show:
                         print(f"{filename}: {caption}")
-                    self.captions[url] = caption
+                    current_images[url] = {
+                        "etag": etags.get(url), "sha1": sha1, "caption": caption, "description": description,
+                    }
+                    if sink is None:
+                        self.captions[url] = caption
+                    else:
+                        sink.write(make_record(
+                            url, caption, "MetadataImageCaptioner", routing_reason="direct",
+                            latencies={"metadata": metadata_time, "caption": caption_time},
+                            model="placeholder", prompt=self.template.full_text(),
+                        ))
+                elif url in previous_images and previous_images[url].get("caption") is not None:
+                    # Keep the old caption rather than reporting a failed download as a removal
+                    current_images[url] = previous_images[url]
+                elif state:
+                    # Remember the image without a caption, so the next run retries it even if
+                    # the revision is unchanged and the page is not re-parsed
+                    description = next(
+                        (img["description"] for img in self.image_data if img["link"] == url),
+                        "Description not found."
+                    )
+                    current_images[url] = {"etag": None, "sha1": None, "caption": None, "description": description}
 
             shutil.rmtree(self.image_folder, ignore_errors=True)
-            return self.captions
 
+        if state:
+            self.diff = diff_captions(previous_images, current_images)
+            if sink is None:
+                for url, entry in current_images.items():
+                    if entry.get("caption") is not None:
+                        self.captions.setdefault(url, entry["caption"])
+            state.update_article(self.url, revision_id, current_images)
+            state.save()
+            if show:
+                print(
+                    f"Added: {len(self.diff['added'])}, removed: {len(self.diff['removed'])}, "
+                    f"changed: {len(self.diff['changed'])}"
+                )
+        return self.captions
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caption every image on a Wikipedia page.")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
     url = "https://en.wikipedia.org/wiki/James_Bond"
     prompt_template = "Context: {context}\nDescription: {full_description}"
 
     cap = MetadataImageCaptioner(url, prompt_template)
-    captions = asyncio.run(cap.process_images(show=True))
+    captions = asyncio.run(cap.process_images(
+        show=True, state_path="captions_state.json", profile=profiler_from_args(args)
+    ))
     print(captions)
+    print(cap.diff)
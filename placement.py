@@ -0,0 +1,192 @@
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+# Points per block when streaming over a memory-mapped input, and the number of
+# (scenario, point) elements solve_batch works on at once.
+BLOCK_SIZE = 1 << 20
+
+REFERENCE_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "1.cpp")
+
+
+def load_points(path):
+    """
+    Load wind farms as an (n, 3) int64 array of x, y, premium.
+    .npy files are memory-mapped; text files use the 1.cpp input format
+    (n, then n lines of "x y premium").
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    values = np.fromfile(path, dtype=np.int64, sep=" ")
+    n = int(values[0])
+    return values[1:1 + 3 * n].reshape(n, 3)
+
+
+def convert_text_input(text_path, npy_path):
+    """Convert a 1.cpp text input to .npy so later runs can memory-map it."""
+    np.save(npy_path, np.ascontiguousarray(load_points(text_path)))
+    return npy_path
+
+
+def weighted_median(values, weights):
+    """
+    Lower weighted median: the smallest value v with weight(values <= v) >= total / 2.
+    This minimises sum(weights * |values - v|). O(n log n).
+    """
+    values = np.asarray(values)
+    weights = np.asarray(weights, dtype=np.float64)
+    order = np.argsort(values, kind="stable")
+    cumulative = np.cumsum(weights[order])
+    index = np.searchsorted(cumulative, cumulative[-1] / 2.0)
+    return values[order[index]]
+
+
+def weighted_median_batch(values, weights, order=None):
+    """
+    Weighted medians of the same points under many weightings at once.
+    :param values: (n,) coordinates.
+    :param weights: (s, n) premiums, one row per scenario.
+    :param order: Optional argsort of values, to reuse one sort across calls.
+    :return: (s,) medians. The sort is done once for all scenarios.
+    """
+    values = np.asarray(values)
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    if order is None:
+        order = np.argsort(values, kind="stable")
+    cumulative = np.cumsum(weights[:, order], axis=1)
+    index = (cumulative >= cumulative[:, -1:] / 2.0).argmax(axis=1)
+    return values[order[index]]
+
+
+def total_cost(points, cx, cy, block_size=BLOCK_SIZE):
+    """Weighted Manhattan cost of placing the control centre at (cx, cy), computed in blocks."""
+    cost = 0
+    for start in range(0, len(points), block_size):
+        block = np.asarray(points[start:start + block_size], dtype=np.int64)
+        distance = np.abs(block[:, 0] - cx) + np.abs(block[:, 1] - cy)
+        cost += int(np.dot(block[:, 2], distance))
+    return cost
+
+
+def solve(points):
+    """
+    Cost-minimal control centre for the weighted Manhattan objective: the weighted
+    median of each axis, taken independently.
+    :return: (cx, cy, cost)
+    """
+    x = np.asarray(points[:, 0])
+    y = np.asarray(points[:, 1])
+    premium = np.asarray(points[:, 2])
+    cx = int(weighted_median(x, premium))
+    cy = int(weighted_median(y, premium))
+    return cx, cy, total_cost(points, cx, cy)
+
+
+def solve_batch(points, premiums, block_size=BLOCK_SIZE):
+    """
+    Solve many scenarios that share farm locations but differ in premiums.
+    Scenarios are processed in chunks of about block_size (scenario, point) elements,
+    so memory stays bounded however many scenarios there are.
+    :param points: (n, 2) or (n, 3) array; only x and y are used.
+    :param premiums: (s, n) premiums (may be memory-mapped).
+    :return: (cx, cy, cost) arrays of shape (s,).
+    """
+    x = np.asarray(points[:, 0], dtype=np.int64)
+    y = np.asarray(points[:, 1], dtype=np.int64)
+    order_x = np.argsort(x, kind="stable")
+    order_y = np.argsort(y, kind="stable")
+    if np.ndim(premiums) == 1:
+        premiums = np.asarray(premiums)[None, :]
+    s = len(premiums)
+    cx = np.empty(s, dtype=np.int64)
+    cy = np.empty(s, dtype=np.int64)
+    cost = np.empty(s, dtype=np.int64)
+    rows = max(1, block_size // max(1, len(x)))
+    for start in range(0, s, rows):
+        chunk = np.asarray(premiums[start:start + rows], dtype=np.int64)
+        end = start + len(chunk)
+        cx[start:end] = weighted_median_batch(x, chunk, order_x)
+        cy[start:end] = weighted_median_batch(y, chunk, order_y)
+        distance = np.abs(x[None, :] - cx[start:end, None]) + np.abs(y[None, :] - cy[start:end, None])
+        cost[start:end] = np.einsum("sn,sn->s", chunk, distance)
+    return cx, cy, cost
+
+
+def compile_reference(output_dir, source=REFERENCE_SOURCE):
+    """Compile 1.cpp into output_dir with the system C++ compiler; returns the binary path or None."""
+    compiler = shutil.which("g++") or shutil.which("clang++")
+    if compiler is None:
+        return None
+    binary = os.path.join(output_dir, "reference")
+    subprocess.run([compiler, "-O2", "-o", binary, source], check=True)
+    return binary
+
+
+def benchmark(n=1_000_000, seed=0, binary=None, source=REFERENCE_SOURCE):
+    """
+    Compare this solver with the 1.cpp binary on random input: runtime, the cost the
+    binary reports, the true cost of the point it picks, and the weighted optimum.
+    """
+    rng = np.random.default_rng(seed)
+    points = np.column_stack([
+        rng.integers(-10 ** 6, 10 ** 6, n),
+        rng.integers(-10 ** 6, 10 ** 6, n),
+        rng.integers(1, 1000, n),
+    ]).astype(np.int64)
+
+    work_dir = tempfile.mkdtemp(prefix="placement_bench_")
+    try:
+        _benchmark(points, work_dir, binary, source)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _benchmark(points, work_dir, binary, source):
+    n = len(points)
+    text_path = os.path.join(work_dir, "input.txt")
+    with open(text_path, "w") as f:
+        f.write(f"{n}\n")
+        np.savetxt(f, points, fmt="%d")
+    npy_path = convert_text_input(text_path, os.path.join(work_dir, "input.npy"))
+
+    start = time.perf_counter()
+    cx, cy, cost = solve(load_points(npy_path))
+    python_time = time.perf_counter() - start
+    print(f"Python weighted median: ({cx}, {cy}) cost {cost} in {python_time:.3f}s")
+
+    # Reference point of 1.cpp: unweighted lower medians
+    ux, uy = int(np.sort(points[:, 0])[(n - 1) // 2]), int(np.sort(points[:, 1])[(n - 1) // 2])
+    print(f"Unweighted median point: ({ux}, {uy}) true cost {total_cost(points, ux, uy)}")
+
+    binary = binary or compile_reference(work_dir, source)
+    if binary is None:
+        print("No C++ compiler found, skipping the 1.cpp comparison.")
+    else:
+        with open(text_path) as f:
+            start = time.perf_counter()
+            output = subprocess.run([binary], stdin=f, capture_output=True, text=True, check=True).stdout
+            cpp_time = time.perf_counter() - start
+        print(f"1.cpp reported cost {output.strip()} in {cpp_time:.3f}s (including text parsing)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Weighted-median placement of the control centre.")
+    parser.add_argument("input", nargs="?", help="1.cpp-format text input or .npy file of (x, y, premium) rows.")
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark against the 1.cpp binary.")
+    parser.add_argument("--points", type=int, default=1_000_000, help="Number of random points for --benchmark.")
+    parser.add_argument("--binary", help="Prebuilt 1.cpp binary for --benchmark (compiled from 1.cpp if omitted).")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.points, binary=args.binary)
+    elif args.input:
+        cx, cy, cost = solve(load_points(args.input))
+        print(cost)
+        print(f"Control centre at ({cx}, {cy})")
+    else:
+        parser.print_help()
@@ -0,0 +1,242 @@
+import asyncio
+import cProfile
+import io
+import itertools
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+def _acquire_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _release_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        # Leave tracemalloc alone if someone else had started it
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+# Event loops in debug mode for profiling: loop -> [watchers, original debug flag, original slow_callback_duration]
+_loop_watchers = {}
+_loop_lock = threading.Lock()
+
+
+def _watch_loop(loop, slow_callback_duration):
+    with _loop_lock:
+        state = _loop_watchers.get(loop)
+        if state is None:
+            _loop_watchers[loop] = [1, loop.get_debug(), loop.slow_callback_duration]
+            loop.set_debug(True)
+            loop.slow_callback_duration = slow_callback_duration
+        else:
+            state[0] += 1
+
+
+def _unwatch_loop(loop):
+    """Restore the loop's original settings once the last overlapping run stops watching it."""
+    with _loop_lock:
+        state = _loop_watchers[loop]
+        state[0] -= 1
+        if state[0] == 0:
+            del _loop_watchers[loop]
+            loop.set_debug(state[1])
+            loop.slow_callback_duration = state[2]
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Collects asyncio debug-mode warnings about slow callbacks."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if "took" in message:
+            self.messages.append(message)
+
+
+class ProfileRun:
+    """Profiling data of one run of an entry point, split into stages."""
+
+    # Only one cProfile can be active at a time, so concurrent stages fall back to timing only.
+    _cprofile_lock = threading.Lock()
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.run_id = f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_{next(profiler._counter)}"
+        self.stages = {}
+        self.profiles = {}
+        self.allocations = {}
+        self.asyncio_info = None
+        self._slow_callbacks = None
+        self._loop = None
+        _acquire_tracemalloc()
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Profile a block of code as a named stage."""
+        profile = cProfile.Profile() if self._cprofile_lock.acquire(blocking=False) else None
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) is already active
+                self._cprofile_lock.release()
+                profile = None
+        before = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self._cprofile_lock.release()
+                self.profiles.setdefault(name, []).append(profile)
+            after = tracemalloc.take_snapshot()
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            self.allocations.setdefault(name, []).extend(after.compare_to(before, "lineno")[: self.profiler.top])
+
+    def watch_event_loop(self):
+        """Turn on asyncio debug mode for the running loop and record slow callbacks."""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        _watch_loop(self._loop, self.profiler.slow_callback_duration)
+        self._slow_callbacks = _SlowCallbackHandler()
+        logging.getLogger("asyncio").addHandler(self._slow_callbacks)
+
+    def _stop_watching_event_loop(self):
+        if self._loop is None:
+            return
+        tasks = [t for t in asyncio.all_tasks(self._loop) if not t.done()]
+        self.asyncio_info = {
+            "slow_callbacks": self._slow_callbacks.messages,
+            "pending_tasks": len(tasks),
+            "pending_task_names": [t.get_name() for t in tasks][: self.profiler.top],
+        }
+        logging.getLogger("asyncio").removeHandler(self._slow_callbacks)
+        _unwatch_loop(self._loop)
+        self._loop = None
+
+    def finish(self):
+        """Stop profiling and write the results to the profiler's output directory."""
+        self._stop_watching_event_loop()
+        current, peak = tracemalloc.get_traced_memory()
+        _release_tracemalloc()
+        total = time.perf_counter() - self.start
+
+        run_dir = os.path.join(self.profiler.output_dir, self.run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        report = io.StringIO()
+        for name, profiles in self.profiles.items():
+            stats = pstats.Stats(*profiles, stream=report)
+            stats.dump_stats(os.path.join(run_dir, f"{name}.prof"))
+            report.write(f"=== Stage {name}: {self.stages[name]:.3f}s ===\n")
+            stats.sort_stats("cumulative").print_stats(self.profiler.top)
+        for name, diffs in self.allocations.items():
+            top = sorted(diffs, key=lambda stat: abs(stat.size_diff), reverse=True)[: self.profiler.top]
+            report.write(f"=== Top allocations in {name} ===\n")
+            report.write("".join(f"{stat}\n" for stat in top))
+        with open(os.path.join(run_dir, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+
+        diagnostics = {
+            "entry_point": self.name,
+            "total_seconds": total,
+            "stage_seconds": self.stages,
+            "traced_memory_current": current,
+            "traced_memory_peak": peak,
+            "asyncio": self.asyncio_info,
+        }
+        with open(os.path.join(run_dir, "diagnostics.json"), "w", encoding="utf-8") as f:
+            json.dump(diagnostics, f, indent=2)
+        print(f"Profile written to {run_dir}")
+        return run_dir
+
+
+class _NullRun:
+    """Stand-in used when profiling is off or the request is not sampled."""
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def watch_event_loop(self):
+        pass
+
+    def finish(self):
+        return None
+
+
+NULL_RUN = _NullRun()
+
+
+class Profiler:
+    """
+    Per-run profiling for the caption entry points. In service mode set sample_every
+    to N to profile only every Nth run and keep the overhead low.
+    """
+
+    def __init__(self, output_dir="profiles", sample_every=1, top=25, slow_callback_duration=0.1):
+        self.output_dir = output_dir
+        self.sample_every = max(1, sample_every)
+        self.top = top
+        self.slow_callback_duration = slow_callback_duration
+        self._counter = itertools.count()
+        self._requests = itertools.count()
+
+    def start_run(self, name):
+        """Start a ProfileRun for this request, or return a no-op run if it is not sampled."""
+        if next(self._requests) % self.sample_every:
+            return NULL_RUN
+        return ProfileRun(self, name)
+
+
+def start_profile(profile, name):
+    """
+    Start a run for an entry point's profile argument: None/False disables profiling,
+    True uses a default Profiler, and a Profiler instance is used as-is.
+    """
+    if not profile:
+        return NULL_RUN
+    if profile is True:
+        profile = Profiler()
+    return profile.start_run(name)
+
+
+def add_profile_arguments(parser):
+    """Add --profile, --profile-dir and --profile-every to an argparse parser."""
+    parser.add_argument("--profile", action="store_true", help="Write cProfile, tracemalloc and asyncio diagnostics.")
+    parser.add_argument("--profile-dir", default="profiles", help="Directory for profiling output.")
+    parser.add_argument("--profile-every", type=int, default=1, help="Only profile every Nth run.")
+
+
+def profiler_from_args(args):
+    """Build a Profiler from parsed arguments, or None if profiling is off."""
+    if not args.profile:
+        return None
+    return Profiler(output_dir=args.profile_dir, sample_every=args.profile_every)
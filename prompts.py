@@ -0,0 +1,166 @@
+import re
+import string
+from functools import lru_cache
+
+from streaming import write_json_payload
+
+# Placeholder names accepted in templates and the metadata key each one reads.
+FIELD_ALIASES = {
+    "title": "title",
+    "Title": "title",
+    "context": "title",
+    "description": "description",
+    "Description": "description",
+    "full_description": "description",
+}
+
+# Used when a metadata record has no value for a field.
+FIELD_DEFAULTS = {"title": "No title", "description": "No description"}
+
+# Default cap on the estimated tokens of all metadata inserted into one prompt.
+METADATA_TOKEN_BUDGET = 256
+
+# Rough stand-in for a BPE tokenizer: words and single punctuation marks.
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Approximate number of model tokens in text."""
+    return sum(1 for _ in _TOKEN.finditer(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text after its first max_tokens (estimated) tokens, marking the cut with '...'."""
+    if max_tokens <= 0:
+        return ""
+    for i, match in enumerate(_TOKEN.finditer(text), 1):
+        if i == max_tokens:
+            end = match.end()
+            return text if not text[end:].strip() else text[:end] + "..."
+    return text
+
+
+def fit_to_budget(values, max_tokens):
+    """
+    Truncate metadata values so their estimated tokens sum to at most max_tokens.
+    Short values are kept whole and the remaining budget is split evenly between
+    the longer ones.
+    """
+    counts = {key: estimate_tokens(value) for key, value in values.items()}
+    remaining = max_tokens
+    fitted = {}
+    for i, key in enumerate(sorted(values, key=counts.get)):
+        share = remaining // (len(values) - i)
+        if counts[key] <= share:
+            fitted[key] = values[key]
+            remaining -= counts[key]
+        else:
+            fitted[key] = truncate_to_tokens(values[key], share)
+            remaining -= share
+    return fitted
+
+
+class PromptTemplate:
+    """
+    A prompt template parsed and validated once. Placeholders must be names from
+    FIELD_ALIASES; render() fills them from a metadata dictionary.
+    """
+
+    def __init__(self, template, system=None, max_tokens=METADATA_TOKEN_BUDGET):
+        self.template = template
+        self.system = system
+        self.max_tokens = max_tokens
+        self._parts = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(template):
+            if field is None:
+                self._parts.append((literal, None))
+                continue
+            if field not in FIELD_ALIASES:
+                raise ValueError(
+                    f"Unknown placeholder {{{field}}} in prompt template; expected one of {sorted(FIELD_ALIASES)}"
+                )
+            if format_spec or conversion:
+                raise ValueError(f"Format specs and conversions are not supported: {{{field}}}")
+            self._parts.append((literal, FIELD_ALIASES[field]))
+        self.fields = sorted({key for _, key in self._parts if key is not None})
+
+    def render(self, metadata, max_tokens=None):
+        """
+        Fill the template from metadata, collapsing whitespace and truncating the
+        values to the token budget (the template's own unless max_tokens is given).
+        """
+        values = {}
+        for key in self.fields:
+            value = metadata.get(key) or FIELD_DEFAULTS[key]
+            values[key] = " ".join(str(value).split())
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        if budget is not None:
+            values = fit_to_budget(values, budget)
+        return "".join(literal + (values[key] if key else "") for literal, key in self._parts)
+
+    def full_text(self, system=None):
+        """
+        System prompt and template as one string. This is what caption records hash, so
+        every captioner should build its prompt_hash input here.
+        :param system: System prompt actually sent, if it differs from the template's own.
+        """
+        system = self.system if system is None else system
+        return self.template if system is None else f"{system}\n{self.template}"
+
+
+# Named templates shared by the captioners.
+TEMPLATES = {}
+
+
+def register_template(name, template, system=None, max_tokens=METADATA_TOKEN_BUDGET):
+    """Compile a template and store it under name; raises ValueError if it is invalid."""
+    TEMPLATES[name] = PromptTemplate(template, system=system, max_tokens=max_tokens)
+    return TEMPLATES[name]
+
+
+@lru_cache(maxsize=256)
+def _compile(template):
+    return PromptTemplate(template)
+
+
+def get_template(template):
+    """
+    Return a compiled template: a registered name, a PromptTemplate, or a raw
+    template string (compiled once and cached).
+    """
+    if isinstance(template, PromptTemplate):
+        return template
+    if template in TEMPLATES:
+        return TEMPLATES[template]
+    return _compile(template)
+
+
+# Shared preamble sent as the Ollama system prompt. Keeping it identical across calls lets
+# the server reuse the already-evaluated prefix instead of re-processing it for every caption.
+CAPTION_SYSTEM_PROMPT = (
+    "You are an intelligent assistant. Based on the given title and metadata, "
+    "generate a descriptive caption for the image."
+)
+CAPTION_PROMPT = "Title: {context}. Metadata: {full_description}."
+LLAVA_PROMPT = "Here is the information about the image: Title: {Title} Description: {Description}"
+
+register_template("caption", CAPTION_PROMPT, system=CAPTION_SYSTEM_PROMPT)
+register_template("llava", LLAVA_PROMPT)
+
+
+def ollama_request(model, prompt, system=None, keep_alive=None, **kwargs):
+    """Keyword arguments for ollama.generate / ollama.Client.generate."""
+    request = {"model": model, "prompt": prompt, **kwargs}
+    if system is not None:
+        request["system"] = system
+    if keep_alive is not None:
+        request["keep_alive"] = keep_alive
+    return request
+
+
+def llava_payload(path, model, prompt, image_paths, **kwargs):
+    """
+    Write the JSON body for the LLaVA HTTP endpoint to path, with the images streamed
+    in as base64. Returns a streaming.FilePayload.
+    """
+    return write_json_payload(path, {"model": model, "prompt": prompt, "stream": False, **kwargs}, image_paths)
@@ -1,25 +1,13 @@
-import pyttsx3
-
-# Initialize the TTS engine
-engine = pyttsx3.init()
-
-# Set properties (optional)
-engine.setProperty("rate", 150)  # Speed of speech
-engine.setProperty("volume", 0.9)  # Volume (0.0 to 1.0)
-
-# Get available voices and set a specific voice
-voices = engine.getProperty("voices")
-engine.setProperty("voice", voices[0].id)  # Choose a voice (e.g., male or female)
+from tts import TextToSpeech, play
 
 # Text to be converted to speech
 text = """Music is the arrangement of sounds to create harmony, rhythm, and melody. It is a universal form of expression that connects people across cultures."""
 
-# Convert text to speech
-engine.say(text)
-
-# Wait for the speech to finish
-engine.runAndWait()
+if __name__ == "__main__":
+    # Speed of speech, volume (0.0 to 1.0) and voice (None uses the engine's default voice)
+    with TextToSpeech(rate=150, volume=0.9, voice=None) as tts:
+        # Synthesize once (or reuse the cached audio) and save the output
+        audio_path = tts.synthesize(text, output_path="output_audio.wav")
 
-# Save the output to an audio file (if supported by the platform)
-engine.save_to_file(text, "output_audio.mp3")
-engine.runAndWait()
+    # Play the saved file instead of synthesizing the text a second time
+    play(audio_path)
@@ -0,0 +1,260 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open."""
+
+
+class RequestAborted(Exception):
+    """Raised for requests made on an AbortableSession after it was closed."""
+
+
+class CircuitBreaker:
+    """Fail fast after repeated failures instead of waiting on an unhealthy service."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Current state of the breaker."""
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self):
+        """Return True if a call may go through (closed, or a half-open probe)."""
+        with self._lock:
+            state = self._state()
+            if state == self.HALF_OPEN:
+                # Let a single probe through and hold the breaker open for the rest.
+                self.opened_at = time.monotonic()
+                return True
+            return state == self.CLOSED
+
+    def record_success(self):
+        """Close the breaker after a successful call."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """Count a failed call and open the breaker once the threshold is reached."""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """Run func through the breaker, raising CircuitOpenError when it is open."""
+        if not self.allow_request():
+            raise CircuitOpenError("Circuit breaker is open, skipping call.")
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=8.0):
+    """Exponential backoff with full jitter for the given attempt (0-based)."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def retry_call(func, *args, retries=3, base_delay=0.5, max_delay=8.0, retry_on=(Exception,), **kwargs):
+    """Call func, retrying on the given exceptions with jittered exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except retry_on as e:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"Attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def hedged_call(func, targets, hedge_delay=0.5, timeout=None):
+    """
+    Call func(target) for each target, starting the next one only if the previous
+    has not answered within hedge_delay seconds. The first successful result wins;
+    calls that have not started yet are cancelled and late results are discarded.
+    :param func: Callable taking a single target (e.g. an endpoint URL).
+    :param targets: Ordered list of targets, preferred first.
+    :param hedge_delay: Seconds to wait before hedging to the next target.
+    :param timeout: Overall deadline in seconds, or None to wait for the calls' own timeouts.
+    :return: Result of the first successful call.
+    """
+    if not targets:
+        raise ValueError("hedged_call needs at least one target.")
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    executor = ThreadPoolExecutor(max_workers=len(targets))
+    pending = set()
+    errors = []
+    try:
+        remaining = list(targets)
+        while remaining or pending:
+            if remaining:
+                pending.add(executor.submit(func, remaining.pop(0)))
+            wait_for = hedge_delay if remaining else None
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                wait_for = left if wait_for is None else min(wait_for, left)
+
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(e)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    if errors:
+        raise errors[-1]
+    raise TimeoutError("No hedged call completed before the deadline.")
+
+
+def _tracking_pool(base, connections):
+    class TrackingPool(base):
+        def _get_conn(self, timeout=None):
+            conn = super()._get_conn(timeout)
+            connections.add(conn)
+            return conn
+
+    return TrackingPool
+
+
+class _TrackingAdapter(HTTPAdapter):
+    """HTTPAdapter that remembers the connections it hands out."""
+
+    def __init__(self, connections, **kwargs):
+        self._connections = connections
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _tracking_pool(HTTPConnectionPool, self._connections),
+            "https": _tracking_pool(HTTPSConnectionPool, self._connections),
+        }
+
+
+class AbortableSession(requests.Session):
+    """
+    requests.Session whose in-flight requests are aborted when it is closed, even
+    from another thread. Used to stop the losing attempts of a hedged call.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._connections = weakref.WeakSet()
+        self._closed = False
+        adapter = _TrackingAdapter(self._connections)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, *args, **kwargs):
+        if self._closed:
+            raise RequestAborted("Session was closed.")
+        try:
+            return super().request(*args, **kwargs)
+        except requests.RequestException:
+            # A connection error caused by close() is an abort, not something to retry
+            if self._closed:
+                raise RequestAborted("Session was closed.") from None
+            raise
+
+    def close(self):
+        self._closed = True
+        for conn in list(self._connections):
+            sock = getattr(conn, "sock", None)
+            if sock is not None:
+                try:
+                    # Wakes up a thread blocked reading the response
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        super().close()
+
+
+async def async_retry_call(func, *args, retries=3, base_delay=0.5, max_delay=8.0, retry_on=(Exception,), **kwargs):
+    """Async version of retry_call; func must be a coroutine function."""
+    for attempt in range(retries + 1):
+        try:
+            return await func(*args, **kwargs)
+        except retry_on as e:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"Attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def async_hedged_call(func, targets, hedge_delay=0.5, timeout=None):
+    """
+    Async version of hedged_call; func must be a coroutine function. Unlike the
+    threaded version, the losing calls are actually cancelled.
+    """
+    if not targets:
+        raise ValueError("async_hedged_call needs at least one target.")
+
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    pending = set()
+    errors = []
+    try:
+        remaining = list(targets)
+        while remaining or pending:
+            if remaining:
+                pending.add(asyncio.ensure_future(func(remaining.pop(0))))
+            wait_for = hedge_delay if remaining else None
+            if deadline is not None:
+                left = deadline - loop.time()
+                if left <= 0:
+                    break
+                wait_for = left if wait_for is None else min(wait_for, left)
+
+            done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                errors.append(task.exception())
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if errors:
+        raise errors[-1]
+    raise TimeoutError("No hedged call completed before the deadline.")
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import time
+from urllib.parse import unquote, urlparse
+
+
+def canonical_filename(image_url):
+    """Return the Wikimedia file name for an image URL, resolving thumbnail URLs to the original."""
+    parts = unquote(urlparse(image_url).path).rstrip("/").split("/")
+    # Thumbnails look like .../thumb/a/ab/Name.jpg/220px-Name.jpg
+    if "thumb" in parts and len(parts) >= 2:
+        return parts[-2]
+    return parts[-1]
+
+
+def prompt_hash(prompt):
+    """Short stable hash of a prompt, used to group captions produced by the same prompt."""
+    if prompt is None:
+        return None
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def make_record(url, caption, captioner, routing_reason=None, latencies=None, model=None, prompt=None):
+    """Build one caption record as written by the sinks."""
+    return {
+        "url": url,
+        "canonical_file": canonical_filename(url),
+        "caption": caption,
+        "captioner": captioner,
+        "routing_reason": routing_reason,
+        "latencies": latencies or {},
+        "model": model,
+        "prompt_hash": prompt_hash(prompt),
+        "created_at": time.time(),
+    }
+
+
+class JsonlSink:
+    """Append caption records to a JSON Lines file, flushing every batch_size records."""
+
+    def __init__(self, path, batch_size=100):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        """Queue a record, writing the batch out once it is full."""
+        self.buffer.append(record)
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write out buffered records."""
+        if not self.buffer:
+            return
+        self._file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in self.buffer))
+        self._file.flush()
+        self.buffer = []
+
+    def close(self):
+        """Flush remaining records and close the file."""
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetSink(JsonlSink):
+    """Write caption records to a Parquet file, one row group per batch. Requires pyarrow."""
+
+    def __init__(self, path, batch_size=1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("ParquetSink requires pyarrow: pip install pyarrow") from e
+
+        self._pa = pa
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0
+        self.schema = pa.schema([
+            ("url", pa.string()),
+            ("canonical_file", pa.string()),
+            ("caption", pa.string()),
+            ("captioner", pa.string()),
+            ("routing_reason", pa.string()),
+            ("latencies", pa.map_(pa.string(), pa.float64())),
+            ("model", pa.string()),
+            ("prompt_hash", pa.string()),
+            ("created_at", pa.float64()),
+        ])
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = pq.ParquetWriter(path, self.schema)
+
+    def flush(self):
+        """Write buffered records as one row group."""
+        if not self.buffer:
+            return
+        rows = [dict(r, latencies=list(r["latencies"].items())) for r in self.buffer]
+        self._file.write_table(self._pa.Table.from_pylist(rows, schema=self.schema))
+        self.buffer = []
+
+
+def open_sink(path, batch_size=None):
+    """Open a JsonlSink or ParquetSink based on the file extension."""
+    sink_class = ParquetSink if path.endswith((".parquet", ".pq")) else JsonlSink
+    if batch_size is None:
+        return sink_class(path)
+    return sink_class(path, batch_size=batch_size)
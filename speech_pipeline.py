@@ -0,0 +1,148 @@
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+
+from tts import TextToSpeech, concatenate_wavs
+
+# Sentence end: punctuation followed by whitespace.
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class SentenceBuffer:
+    """Collect streamed text fragments and hand out complete sentences."""
+
+    def __init__(self):
+        self.text = ""
+
+    def feed(self, fragment):
+        """Add a fragment and return the sentences it completed."""
+        self.text += fragment
+        parts = _SENTENCE_END.split(self.text)
+        self.text = parts.pop()
+        return [p.strip() for p in parts if p.strip()]
+
+    def flush(self):
+        """Return whatever is left as a final sentence."""
+        rest, self.text = self.text.strip(), ""
+        return [rest] if rest else []
+
+
+def caption_to_speech(tokens, tts, output_dir, on_segment=None, combined_path=None, first_audio_target=None):
+    """
+    Turn a stream of caption fragments into audio segments as each sentence completes.
+    Sentences are synthesized in parallel by the TTS workers while the caption is still
+    being generated, and segments are written in order to output_dir as segment_000.wav, ...
+    :param tokens: Iterable of text fragments, e.g. MetadataImageCaptioner.stream_caption(...).
+    :param tts: TextToSpeech instance.
+    :param output_dir: Directory for the audio segments.
+    :param on_segment: Optional callback called with (index, path, sentence) for each segment.
+    :param combined_path: Optional path for all segments concatenated into one file.
+    :param first_audio_target: Optional time-to-first-audio target in seconds.
+    :return: Dictionary with the caption, segment paths and timings.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    pending = queue.Queue()
+    segments = []
+    report = {"time_to_first_token": None, "time_to_first_audio": None}
+
+    def emit():
+        # Write segments in caption order as soon as each one (and all before it) is ready
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            sentence, future = item
+            if future.cancelled():
+                continue
+            try:
+                cached_path = future.result()
+            except Exception as e:
+                print(f"Error synthesizing '{sentence}': {e}")
+                continue
+            path = os.path.join(output_dir, f"segment_{len(segments):03d}.wav")
+            shutil.copyfile(cached_path, path)
+            if report["time_to_first_audio"] is None:
+                report["time_to_first_audio"] = time.perf_counter() - start
+            segments.append(path)
+            if on_segment:
+                on_segment(len(segments) - 1, path, sentence)
+
+    emitter = threading.Thread(target=emit, daemon=True)
+    emitter.start()
+
+    buffer = SentenceBuffer()
+    caption = []
+    submitted = []
+
+    def submit(sentence):
+        future = tts.submit_chunk(sentence)
+        submitted.append(future)
+        pending.put((sentence, future))
+
+    try:
+        for fragment in tokens:
+            if report["time_to_first_token"] is None:
+                report["time_to_first_token"] = time.perf_counter() - start
+            caption.append(fragment)
+            for sentence in buffer.feed(fragment):
+                submit(sentence)
+        for sentence in buffer.flush():
+            submit(sentence)
+    except BaseException:
+        # The caption stream failed: drop sentences that have not started synthesizing
+        for future in submitted:
+            future.cancel()
+        raise
+    finally:
+        # Always stop the emitter, so it is not left blocked on the queue
+        pending.put(None)
+        emitter.join()
+
+    if combined_path and segments:
+        concatenate_wavs(segments, combined_path)
+
+    report.update({
+        "caption": "".join(caption),
+        "segments": segments,
+        "combined_path": combined_path if segments else None,
+        "total_time": time.perf_counter() - start,
+    })
+    if first_audio_target is not None:
+        first_audio = report["time_to_first_audio"]
+        report["first_audio_target"] = first_audio_target
+        report["met_first_audio_target"] = first_audio is not None and first_audio <= first_audio_target
+        if not report["met_first_audio_target"]:
+            print(f"Time to first audio {first_audio} missed the {first_audio_target}s target.")
+    return report
+
+
+if __name__ == "__main__":
+    # Offline demo: a simulated token stream read out by the fake TTS engine.
+    from tts import fake_engine
+
+    caption = (
+        "A black and white portrait of Hoagy Carmichael seated at a piano. "
+        "He is wearing a suit and tie and looks towards the camera. "
+        "The photograph was taken in 1947."
+    )
+
+    def fake_tokens(text, delay=0.02):
+        for word in text.split(" "):
+            time.sleep(delay)
+            yield word + " "
+
+    # Separate cache so the demo's silent audio never mixes with real speech in tts_cache
+    with TextToSpeech(cache_dir="tts_cache_demo", engine_factory=fake_engine) as tts:
+        report = caption_to_speech(
+            fake_tokens(caption), tts, "speech_output",
+            on_segment=lambda i, path, sentence: print(f"Segment {i} ready: {path} ({sentence})"),
+            combined_path=os.path.join("speech_output", "caption.wav"),
+            first_audio_target=1.0,
+        )
+    print(f"Time to first token: {report['time_to_first_token']:.3f}s")
+    print(f"Time to first audio: {report['time_to_first_audio']:.3f}s")
+    print(f"Total time: {report['total_time']:.3f}s")
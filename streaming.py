@@ -0,0 +1,158 @@
+import asyncio
+import base64
+import json
+import mmap
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Bytes read or written per step. A multiple of 3 so base64 chunks concatenate cleanly.
+CHUNK_SIZE = 3 * 64 * 1024
+
+
+def dumps(obj):
+    """Serialize obj to compact JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class MemoryBudget:
+    """
+    Global cap on image bytes held in memory at once. Callers reserve the number of
+    bytes they are about to hold and wait while the budget is exhausted. A single
+    reservation larger than the whole budget is clamped so it can still run alone.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.high_water = 0
+        self._cond = threading.Condition()
+
+    def _clamp(self, n):
+        return max(0, min(n, self.max_bytes))
+
+    def try_acquire(self, n):
+        """Reserve n bytes if they fit right now."""
+        n = self._clamp(n)
+        with self._cond:
+            if self.in_use + n > self.max_bytes:
+                return False
+            self.in_use += n
+            self.high_water = max(self.high_water, self.in_use)
+            return True
+
+    def acquire(self, n):
+        """Reserve n bytes, blocking until they fit."""
+        n = self._clamp(n)
+        with self._cond:
+            while self.in_use + n > self.max_bytes:
+                self._cond.wait()
+            self.in_use += n
+            self.high_water = max(self.high_water, self.in_use)
+
+    def release(self, n):
+        """Give back n bytes."""
+        n = self._clamp(n)
+        with self._cond:
+            self.in_use -= n
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, n):
+        """Hold n bytes of the budget for the duration of the block."""
+        self.acquire(n)
+        try:
+            yield
+        finally:
+            self.release(n)
+
+    @asynccontextmanager
+    async def reserve_async(self, n, poll_interval=0.005):
+        """Async version of reserve that yields to the event loop while waiting."""
+        while not self.try_acquire(n):
+            await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            self.release(n)
+
+
+class FilePayload:
+    """A request body that lives on disk and is streamed to the server when sent."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def open(self):
+        return open(self.path, "rb")
+
+
+def stream_response_to_file(response, path, chunk_size=CHUNK_SIZE):
+    """Write a requests response opened with stream=True to disk chunk by chunk."""
+    size = 0
+    with open(path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+async def stream_aiohttp_response_to_file(response, path, chunk_size=CHUNK_SIZE):
+    """Write an aiohttp response to disk chunk by chunk instead of reading it whole."""
+    size = 0
+    with open(path, "wb") as f:
+        async for chunk in response.content.iter_chunked(chunk_size):
+            f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+@contextmanager
+def mapped_file(path):
+    """Memory-map a file read-only and yield a memoryview over it."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def write_base64(out, path, chunk_size=CHUNK_SIZE):
+    """Base64-encode a file into an open binary stream without loading it whole."""
+    with mapped_file(path) as view:
+        for offset in range(0, len(view), chunk_size):
+            out.write(base64.b64encode(view[offset:offset + chunk_size]))
+
+
+def write_json_payload(path, fields, image_paths=()):
+    """
+    Write a JSON request body to path. fields are serialized normally; the images
+    are streamed in as base64 strings under the "images" key.
+    """
+    with open(path, "wb") as out:
+        out.write(dumps(fields)[:-1])
+        out.write(b',"images":[' if fields else b'"images":[')
+        for i, image_path in enumerate(image_paths):
+            if i:
+                out.write(b",")
+            out.write(b'"')
+            write_base64(out, image_path)
+            out.write(b'"')
+        out.write(b"]}")
+    return FilePayload(path)
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import wave
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# Engine owned by the current worker process, created by _init_worker.
+_worker_engine = None
+
+
+def pyttsx3_engine():
+    """Default engine factory."""
+    import pyttsx3
+
+    return pyttsx3.init()
+
+
+class FakeEngine:
+    """
+    Stand-in for a pyttsx3 engine that writes silent WAV files, for running the
+    TTS code without audio hardware. Audio length follows the speech rate, and
+    synthesis_delay seconds per chunk simulate the engine's work.
+    """
+
+    def __init__(self, sample_rate=16000, synthesis_delay=0.0):
+        self.sample_rate = sample_rate
+        self.synthesis_delay = synthesis_delay
+        self.properties = {"rate": 150, "volume": 1.0, "voice": None}
+        self.queue = []
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def save_to_file(self, text, path):
+        self.queue.append((text, path))
+
+    def runAndWait(self):
+        for text, path in self.queue:
+            time.sleep(self.synthesis_delay)
+            seconds = len(text.split()) * 60.0 / self.properties["rate"]
+            with wave.open(path, "wb") as out:
+                out.setnchannels(1)
+                out.setsampwidth(2)
+                out.setframerate(self.sample_rate)
+                out.writeframes(b"\x00\x00" * int(seconds * self.sample_rate))
+        self.queue = []
+
+
+def fake_engine():
+    """Engine factory for FakeEngine, usable from worker processes."""
+    return FakeEngine(synthesis_delay=0.05)
+
+
+def engine_name(engine_factory):
+    """Stable name of an engine factory, part of the cache key so engines never share audio."""
+    module = getattr(engine_factory, "__module__", None)
+    name = getattr(engine_factory, "__qualname__", None)
+    return f"{module}.{name}" if module and name else repr(engine_factory)
+
+
+def _init_worker(engine_factory):
+    global _worker_engine
+    _worker_engine = engine_factory()
+
+
+def _synthesize_chunk(text, voice, rate, volume, path):
+    """Synthesize one chunk to a WAV file with this worker's engine."""
+    engine = _worker_engine
+    engine.setProperty("rate", rate)
+    engine.setProperty("volume", volume)
+    if voice is not None:
+        engine.setProperty("voice", voice)
+    tmp_path = path + f".{os.getpid()}.tmp.wav"
+    engine.save_to_file(text, tmp_path)
+    engine.runAndWait()
+    os.replace(tmp_path, path)
+    return path
+
+
+def split_sentences(text, max_chars=400):
+    """Split text into sentence chunks of at most max_chars characters (longer sentences are kept whole)."""
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]
+    chunks = []
+    current = ""
+    for sentence in sentences:
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def concatenate_wavs(paths, output_path, frames_per_read=65536):
+    """Concatenate WAV files with identical formats into one file."""
+    tmp_path = output_path + ".tmp"
+    with wave.open(tmp_path, "wb") as out:
+        for i, path in enumerate(paths):
+            with wave.open(path, "rb") as chunk:
+                if i == 0:
+                    out.setparams(chunk.getparams())
+                while True:
+                    frames = chunk.readframes(frames_per_read)
+                    if not frames:
+                        break
+                    out.writeframes(frames)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def play(path):
+    """Play a WAV file with the platform's player."""
+    if sys.platform == "win32":
+        import winsound
+
+        winsound.PlaySound(path, winsound.SND_FILENAME)
+    elif sys.platform == "darwin":
+        subprocess.run(["afplay", path], check=False)
+    elif shutil.which("aplay"):
+        subprocess.run(["aplay", "-q", path], check=False)
+    else:
+        print(f"No audio player found, audio saved to {path}")
+
+
+class TextToSpeech:
+    """
+    Text-to-speech with an on-disk cache keyed on (engine, text, voice, rate, volume).
+    Long text is split into sentence chunks that are synthesized in parallel by
+    worker processes, each with its own engine, and then concatenated.
+    """
+
+    def __init__(self, voice=None, rate=150, volume=0.9, cache_dir="tts_cache", workers=None,
+                 max_chunk_chars=400, engine_factory=pyttsx3_engine):
+        self.voice = voice
+        self.rate = rate
+        self.volume = volume
+        self.cache_dir = cache_dir
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_chunk_chars = max_chunk_chars
+        self.engine_factory = engine_factory
+        self._executor = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, text):
+        """Path of the cached audio for text with the current engine and voice settings."""
+        key = json.dumps([engine_name(self.engine_factory), text, self.voice, self.rate, self.volume])
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".wav")
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker, initargs=(self.engine_factory,)
+            )
+        return self._executor
+
+    def submit_chunk(self, text):
+        """Start synthesizing one chunk in a worker; returns a future for its cached path."""
+        path = self.cache_path(text)
+        if os.path.exists(path):
+            future = Future()
+            future.set_result(path)
+            return future
+        return self._pool().submit(_synthesize_chunk, text, self.voice, self.rate, self.volume, path)
+
+    def synthesize_chunks(self, chunks):
+        """Synthesize chunks in parallel, reusing cached ones, and return their paths in order."""
+        paths = [self.cache_path(chunk) for chunk in chunks]
+        futures = {
+            i: self.submit_chunk(chunk)
+            for i, (chunk, path) in enumerate(zip(chunks, paths)) if not os.path.exists(path)
+        }
+        for i, future in futures.items():
+            paths[i] = future.result()
+        return paths
+
+    def synthesize(self, text, output_path=None):
+        """
+        Synthesize text to a WAV file, using the cache when possible.
+        :param text: Text to speak.
+        :param output_path: Optional path to copy the audio to.
+        :return: Path of the audio file.
+        """
+        path = self.cache_path(text)
+        if not os.path.exists(path):
+            chunks = split_sentences(text, self.max_chunk_chars)
+            if len(chunks) <= 1:
+                self.synthesize_chunks([text])
+            else:
+                concatenate_wavs(self.synthesize_chunks(chunks), path)
+        if output_path:
+            shutil.copyfile(path, output_path)
+            return output_path
+        return path
+
+    def close(self):
+        """Shut down the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()